@@ -0,0 +1,437 @@
+"""
+
+A stand-in for the parts of Twitch that Signum talks to, for testing and
+benchmarking without touching the real site. It serves the home page with a
+client ID, `settings.js` with a Spade URL, the GQL endpoint (the persisted
+operations in `signum.gql.hashes` and the `find_channel` query), the Spade
+endpoint, and a PubSub websocket that sends stream changes and community
+points events to whoever is listening.
+
+    python -m benchmarks.fake_twitch --port 8080 --channels 10
+
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import random
+import re
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional, Set
+
+from aiohttp import web, WSMsgType
+
+log = logging.getLogger(__name__)
+
+CLIENT_ID = "fakeclientid0000000000000000000"
+
+# `Account.fetch_spade_url` skips this many characters before the JSON.
+SETTINGS_PREFIX = "window.__twilightSettings = "
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, login: str, live: bool = True):
+        self.id = channel_id
+        self.login = login
+        self.live = live
+        self.stream_id = random.randint(10 ** 10, 10 ** 11)
+
+    def to_gql(self) -> dict:
+        return {
+            "id": str(self.id),
+            "login": self.login,
+            "displayName": self.login,
+            "description": "",
+            "createdAt": "2015-01-01T00:00:00Z",
+            "roles": {
+                "isPartner": True
+            },
+            "stream": {
+                "id": str(self.stream_id),
+                "title": f"Streaming on {self.login}",
+                "type": "live",
+                "viewersCount": 1000,
+                "createdAt": "2021-12-01T12:00:00.123456Z",
+                "game": {
+                    "name": "Just Chatting"
+                }
+            } if self.live else None
+        }
+
+
+class FakeTwitch:
+    def __init__(
+        self,
+        channel_count: int = 10,
+        event_interval: float = 5.0,
+        stream_change_chance: float = 0.0,
+        latency: float = 0.0
+    ):
+        self.channels: Dict[int, FakeChannel] = {}
+        self.channels_by_login: Dict[str, FakeChannel] = {}
+
+        for index in range(channel_count):
+            self.add_channel(f"channel{index}")
+
+        self.event_interval = event_interval
+        self.stream_change_chance = stream_change_chance
+        self.latency = latency
+
+        self.base_url: Optional[str] = None
+
+        self.requests: Counter = Counter()
+        self.operations: Counter = Counter()
+        self.spade_events = 0
+
+        self._sockets: Set[web.WebSocketResponse] = set()
+        self._topics: Dict[web.WebSocketResponse, Set[str]] = {}
+
+        # Claim ID to when its claim-available event was sent.
+        self._claims_sent: Dict[str, float] = {}
+        self.claim_latencies: List[float] = []
+
+        self._runner: Optional[web.AppRunner] = None
+        self._emitter: Optional[asyncio.Task] = None
+        self.started_at = time.monotonic()
+
+    def add_channel(self, login: str, live: bool = True) -> FakeChannel:
+        channel = FakeChannel(100000 + len(self.channels), login, live)
+
+        self.channels[channel.id] = channel
+        self.channels_by_login[login.lower()] = channel
+
+        return channel
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started_at
+        latencies = sorted(self.claim_latencies)
+
+        def percentile(fraction: float) -> Optional[float]:
+            if not latencies:
+                return None
+
+            return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+        return {
+            "elapsed": elapsed,
+            "requests": dict(self.requests),
+            "operations": dict(self.operations),
+            "requests_per_second": sum(self.requests.values()) / elapsed if elapsed else 0,
+            "spade_events": self.spade_events,
+            "pubsub_connections": len(self._sockets),
+            "pubsub_topics": sum(len(topics) for topics in self._topics.values()),
+            "claims_sent": len(self._claims_sent) + len(self.claim_latencies),
+            "claims_made": len(self.claim_latencies),
+            "claim_latency_p50": percentile(0.5),
+            "claim_latency_p99": percentile(0.99)
+        }
+
+    async def stats_view(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    def reset_stats(self) -> None:
+        self.requests.clear()
+        self.operations.clear()
+        self.spade_events = 0
+        self.claim_latencies.clear()
+        self.started_at = time.monotonic()
+
+    def expect_claim(self, claim_id: str) -> None:
+        """ Start timing a claim from now, for claims the server didn't announce. """
+        self._claims_sent[claim_id] = time.monotonic()
+
+    async def _delay(self) -> None:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+    async def home(self, request: web.Request) -> web.Response:
+        self.requests["home"] += 1
+        await self._delay()
+
+        return web.Response(
+            text=f"<html><script>window.__config = {{\"Client-ID\":\"{CLIENT_ID}\"}};</script></html>",
+            content_type="text/html"
+        )
+
+    async def settings(self, request: web.Request) -> web.Response:
+        self.requests["settings"] += 1
+        await self._delay()
+
+        return web.Response(
+            text=SETTINGS_PREFIX + json.dumps({"spade_url": f"{self.base_url}/spade"}),
+            content_type="application/javascript"
+        )
+
+    async def spade(self, request: web.Request) -> web.Response:
+        self.requests["spade"] += 1
+        await self._delay()
+
+        events = json.loads(base64.b64decode(await request.read()))
+        self.spade_events += len(events)
+
+        return web.Response(status=204)
+
+    async def gql(self, request: web.Request) -> web.Response:
+        self.requests["gql"] += 1
+        await self._delay()
+
+        operations = await request.json()
+
+        if not isinstance(operations, list):
+            operations = [operations]
+
+        return web.json_response([self._operation(operation) for operation in operations])
+
+    def _operation(self, operation: dict) -> dict:
+        variables: dict = operation.get("variables") or {}
+
+        if "query" in operation:
+            return self._query(operation["query"], variables)
+
+        name = operation.get("operationName")
+        self.operations[name] += 1
+
+        if name == "ChatRestrictions":
+            return {"data": {"channel": {"self": {"follower": {"followedAt": "2021-01-01T00:00:00Z"}}}}}
+
+        if name == "ChannelPointsContext":
+            return {"data": {"community": {"channel": {"self": {"communityPoints": {
+                "balance": 1000,
+                "availableClaim": None
+            }}}}}}
+
+        if name == "FollowButton_FollowUser":
+            return {"data": {"followUser": {"follow": {"disableNotifications": False}}}}
+
+        if name == "ClaimCommunityPoints":
+            claim_id = variables["input"]["claimID"]
+            sent = self._claims_sent.pop(claim_id, None)
+
+            if sent is not None:
+                self.claim_latencies.append(time.monotonic() - sent)
+
+            return {"data": {"claimCommunityPoints": {"claim": {"id": claim_id}}}}
+
+        return {"errors": [{"message": "PersistedQueryNotFound"}]}
+
+    def _query(self, query: str, variables: dict) -> dict:
+        # Aliased lookups, as in `alias: user(login: "name") { ... }`.
+        aliases = re.findall(r"(\w+)\s*:\s*user\(login:\s*\"([^\"]+)\"\)", query)
+
+        if aliases:
+            self.operations["findChannels"] += 1
+
+            return {"data": {
+                alias: self._find_user(login) for alias, login in aliases
+            }}
+
+        self.operations["findChannel"] += 1
+
+        return {"data": {"user": self._find_user(variables.get("login", ""))}}
+
+    def _find_user(self, login: str) -> Optional[dict]:
+        channel = self.channels_by_login.get(login.lower())
+
+        return channel.to_gql() if channel else None
+
+    async def pubsub(self, request: web.Request) -> web.WebSocketResponse:
+        socket = web.WebSocketResponse()
+        await socket.prepare(request)
+
+        self._sockets.add(socket)
+        self._topics[socket] = set()
+
+        try:
+            async for message in socket:
+                if message.type != WSMsgType.TEXT:
+                    continue
+
+                data = json.loads(message.data)
+
+                if data["type"] == "PING":
+                    await socket.send_str(json.dumps({"type": "PONG"}))
+
+                elif data["type"] == "LISTEN":
+                    self._topics[socket].update(data["data"]["topics"])
+
+                    await socket.send_str(json.dumps({
+                        "type": "RESPONSE",
+                        "nonce": data.get("nonce"),
+                        "error": ""
+                    }))
+
+                elif data["type"] == "UNLISTEN":
+                    self._topics[socket].difference_update(data["data"]["topics"])
+
+                    await socket.send_str(json.dumps({
+                        "type": "RESPONSE",
+                        "nonce": data.get("nonce"),
+                        "error": ""
+                    }))
+        finally:
+            self._sockets.discard(socket)
+            self._topics.pop(socket, None)
+
+        return socket
+
+    async def _send(self, socket: web.WebSocketResponse, topic: str, message: dict) -> None:
+        await socket.send_str(json.dumps({
+            "type": "MESSAGE",
+            "data": {
+                "topic": topic,
+                "message": json.dumps(message)
+            }
+        }))
+
+    async def broadcast(self, topic_prefix: str, build) -> None:
+        """ Send `build(user_id)` to every topic that starts with the prefix. """
+        for socket, topics in list(self._topics.items()):
+            for topic in list(topics):
+                name, _, user_id = topic.rpartition(".")
+
+                if name == topic_prefix:
+                    message = build(user_id)
+
+                    if message is not None:
+                        await self._send(socket, topic, message)
+
+    def _claim_available(self, user_id: str) -> Optional[dict]:
+        live = [channel for channel in self.channels.values() if channel.live]
+
+        if not live:
+            return None
+
+        channel = random.choice(live)
+        claim_id = str(uuid.uuid4())
+
+        self.expect_claim(claim_id)
+
+        return {
+            "type": "claim-available",
+            "data": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "claim": {
+                    "id": claim_id,
+                    "user_id": user_id,
+                    "channel_id": str(channel.id)
+                }
+            }
+        }
+
+    def _points_earned(self, user_id: str) -> Optional[dict]:
+        live = [channel for channel in self.channels.values() if channel.live]
+
+        if not live:
+            return None
+
+        channel = random.choice(live)
+
+        return {
+            "type": "points-earned",
+            "data": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "channel_id": str(channel.id),
+                "point_gain": {
+                    "user_id": user_id,
+                    "channel_id": str(channel.id),
+                    "total_points": 10,
+                    "reason_code": "WATCH"
+                },
+                "balance": {
+                    "user_id": user_id,
+                    "channel_id": str(channel.id),
+                    "balance": random.randint(0, 100000)
+                }
+            }
+        }
+
+    async def toggle_stream(self, channel: FakeChannel) -> None:
+        channel.live = not channel.live
+
+        if channel.live:
+            channel.stream_id = random.randint(10 ** 10, 10 ** 11)
+
+        message = {
+            "type": "stream_up" if channel.live else "stream_down",
+            "channel_id": str(channel.id),
+            "server_time": time.time()
+        }
+
+        await self.broadcast("stream-change-v1", lambda user_id: message)
+
+    async def _emit(self) -> None:
+        while True:
+            await asyncio.sleep(self.event_interval)
+
+            await self.broadcast("community-points-user-v1", self._claim_available)
+            await self.broadcast("community-points-user-v1", self._points_earned)
+
+            for channel in list(self.channels.values()):
+                if random.random() < self.stream_change_chance:
+                    await self.toggle_stream(channel)
+
+    def application(self) -> web.Application:
+        app = web.Application()
+
+        app.router.add_get("/", self.home)
+        app.router.add_get("/config/settings.js", self.settings)
+        app.router.add_post("/gql", self.gql)
+        app.router.add_post("/spade", self.spade)
+        app.router.add_get("/pubsub", self.pubsub)
+        app.router.add_get("/stats", self.stats_view)
+
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """ Start serving, returning the base URL. Port 0 picks a free port. """
+        self._runner = web.AppRunner(self.application())
+        await self._runner.setup()
+
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{host}:{port}"
+
+        self._emitter = asyncio.get_running_loop().create_task(self._emit())
+
+        return self.base_url
+
+    async def close(self) -> None:
+        if self._emitter is not None:
+            self._emitter.cancel()
+
+        for socket in list(self._sockets):
+            await socket.close()
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Stand-in Twitch server")
+
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--channels", type=int, default=10, help="Number of channels, named channel0 and up")
+    parser.add_argument("--event-interval", type=float, default=5.0, help="Seconds between rounds of PubSub events")
+    parser.add_argument("--stream-change-chance", type=float, default=0.0, help="Chance per round of each channel going up or down")
+
+    args = parser.parse_args()
+
+    server = FakeTwitch(args.channels, args.event_interval, args.stream_change_chance)
+    base_url = await server.start(args.host, args.port)
+
+    print(f"Serving on {base_url}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
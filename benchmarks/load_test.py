@@ -0,0 +1,160 @@
+"""
+
+Runs Signum against the stand-in server in `benchmarks/fake_twitch.py` with
+any number of generated accounts and channels, then reports the startup time,
+requests per second, time from a claim being announced to it being claimed,
+and memory used per account.
+
+    python -m benchmarks.load_test --accounts 200 --channels 30 --duration 60
+
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+import urllib.parse
+from typing import List
+
+from signum.account import Account
+from signum.endpoints import Endpoints
+from signum.manager import Manager
+
+from .fake_twitch import FakeTwitch
+
+
+def write_cookie_file(directory: str, index: int) -> str:
+    """ Write a Netscape cookie file for a made-up account. """
+    user = {
+        "authToken": f"token{index:08d}",
+        "id": str(500000 + index),
+        "login": f"account{index}",
+        "displayName": f"account{index}"
+    }
+
+    cookies = {
+        "twilight-user": urllib.parse.quote(json.dumps(user)),
+        "login": user["login"],
+        "unique_id": f"unique{index:08d}",
+        "auth-token": user["authToken"]
+    }
+
+    path = os.path.join(directory, f"cookie-{index}.txt")
+
+    with open(path, "w", encoding="utf-8") as file_object:
+        file_object.write("# Netscape HTTP Cookie File\n")
+
+        for name, value in cookies.items():
+            file_object.write(f".twitch.tv\tTRUE\t/\tTRUE\t2000000000\t{name}\t{value}\n")
+
+    return path
+
+
+def rss_megabytes() -> float:
+    """ Peak resident memory of this process, in megabytes. """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run(args: argparse.Namespace) -> dict:
+    server = FakeTwitch(
+        channel_count=args.channels,
+        event_interval=args.event_interval,
+        stream_change_chance=args.stream_change_chance,
+        latency=args.latency
+    )
+
+    endpoints = Endpoints.from_base_url(await server.start())
+
+    with tempfile.TemporaryDirectory() as directory:
+        cookie_files: List[str] = [
+            write_cookie_file(directory, index) for index in range(args.accounts)
+        ]
+
+        if args.trace_memory:
+            tracemalloc.start()
+
+        rss_before = rss_megabytes()
+        traced_before = tracemalloc.get_traced_memory()[0] if args.trace_memory else 0
+
+        manager = Manager(
+            [f"channel{index}" for index in range(args.channels)],
+            endpoints=endpoints,
+            watch_interval=args.watch_interval,
+            startup_concurrency=args.startup_concurrency,
+            record_file=args.record
+        )
+
+        for file in cookie_files:
+            manager.add_account(Account(file, endpoints=endpoints))
+
+        started = time.perf_counter()
+        task = asyncio.get_running_loop().create_task(manager.run())
+
+        await asyncio.wait(
+            [task, asyncio.ensure_future(manager.started.wait())],
+            return_when=asyncio.FIRST_COMPLETED
+        )
+
+        if task.done():
+            task.result()
+
+        startup = time.perf_counter() - started
+
+        memory = {
+            "rss_per_account_kb": (rss_megabytes() - rss_before) * 1024 / max(1, args.accounts)
+        }
+
+        if args.trace_memory:
+            memory["traced_per_account_kb"] = (
+                (tracemalloc.get_traced_memory()[0] - traced_before) / 1024 / max(1, args.accounts)
+            )
+
+        server.reset_stats()
+
+        await asyncio.sleep(args.duration)
+
+        stats = server.stats()
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    await server.close()
+
+    return {
+        "accounts": args.accounts,
+        "channels": args.channels,
+        "startup_seconds": startup,
+        **memory,
+        **stats
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Signum load test against a stand-in Twitch server")
+
+    parser.add_argument("--accounts", type=int, default=50)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to measure for after startup")
+    parser.add_argument("--watch-interval", type=float, default=10.0, help="Seconds between watch ticks")
+    parser.add_argument("--event-interval", type=float, default=2.0, help="Seconds between rounds of PubSub events")
+    parser.add_argument("--stream-change-chance", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the server waits before answering")
+    parser.add_argument("--startup-concurrency", type=int, default=20)
+    parser.add_argument("--trace-memory", action="store_true", help="Measure allocations with tracemalloc, which slows everything down")
+    parser.add_argument("--record", type=str, default=None, help="Record the PubSub traffic to this file, for benchmarks/replay.py")
+    parser.add_argument("-v", "--verbose", action="store_true")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+
+Measures the CPU time spent decoding each PubSub message, comparing decoding
+both the envelope and the inner message with the standard library against
+the codec in `signum/codec.py` with the inner message only decoded when the
+manager handles it.
+
+    python -m benchmarks.pubsub_decode --messages 200000 --handled 0.3
+
+"""
+
+import argparse
+import json
+import random
+import time
+from typing import Callable, List
+
+from signum import codec
+from signum.manager import Manager
+
+# Message types that arrive on the account topics but aren't handled.
+UNHANDLED_TYPES = ("reward-redeemed", "custom-reward-updated", "community-goal-contribution", "viewcount")
+
+
+def make_message(handled: bool, index: int) -> str:
+    """ An encoded PubSub envelope shaped like the ones Twitch sends. """
+    channel_id = str(100000 + index % 50)
+    user_id = str(500000 + index % 1000)
+
+    if handled:
+        inner = {
+            "type": "points-earned",
+            "data": {
+                "timestamp": "2024-01-01T00:00:00.000000000Z",
+                "channel_id": channel_id,
+                "point_gain": {
+                    "user_id": user_id,
+                    "channel_id": channel_id,
+                    "total_points": 10,
+                    "baseline_points": 10,
+                    "reason_code": "WATCH",
+                    "multipliers": []
+                },
+                "balance": {"user_id": user_id, "channel_id": channel_id, "balance": 12345}
+            }
+        }
+    else:
+        inner = {
+            "type": random.choice(UNHANDLED_TYPES),
+            "data": {
+                "timestamp": "2024-01-01T00:00:00.000000000Z",
+                "redemption": {
+                    "id": f"{index:032x}",
+                    "user": {"id": user_id, "login": f"user{user_id}"},
+                    "channel_id": channel_id,
+                    "reward": {"id": f"{index:032x}", "title": "Hydrate", "cost": 500, "prompt": "x" * 200}
+                }
+            }
+        }
+
+    return json.dumps({
+        "type": "MESSAGE",
+        "data": {
+            "topic": f"community-points-user-v1.{user_id}",
+            "message": json.dumps(inner, separators=(",", ":"))
+        }
+    })
+
+
+def measure(messages: List[str], decode: Callable[[str], object]) -> float:
+    """ CPU microseconds per message. """
+    started = time.process_time()
+
+    for message in messages:
+        decode(message)
+
+    return (time.process_time() - started) / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU time per PubSub message, before and after lazy decoding")
+
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--handled", type=float, default=0.3, help="Share of messages that have a handler")
+
+    args = parser.parse_args()
+
+    messages = [
+        make_message(random.random() < args.handled, index)
+        for index in range(args.messages)
+    ]
+
+    manager = Manager([])
+
+    # What the manager did before: split the topic and decode every message.
+    def stdlib_eager(message: str) -> object:
+        data = json.loads(message)["data"]
+        return data["topic"].rsplit(".", 1), json.loads(data["message"])
+
+    def codec_eager(message: str) -> object:
+        data = codec.loads(message)["data"]
+        return data["topic"].rsplit(".", 1), codec.loads(data["message"])
+
+    def codec_lazy(message: str) -> object:
+        return manager._decode_event(codec.loads(message))
+
+    results = {
+        "codec": codec.name,
+        "messages": args.messages,
+        "handled": args.handled,
+        "stdlib_eager_us": measure(messages, stdlib_eager),
+        "codec_eager_us": measure(messages, codec_eager),
+        "codec_lazy_us": measure(messages, codec_lazy)
+    }
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+
+Replays PubSub traffic recorded with `--record-pubsub` (or `--record` in the
+load test) through the manager's real dispatch path, with every request the
+handlers make going to the stand-in server in `benchmarks/fake_twitch.py`.
+Frames are fed at the speed they were recorded at, scaled by `--speed`, or
+as fast as possible with `--speed 0`. Reports the CPU time spent in each
+handler, the time from a claim being received to the claim reaching the
+server and, with `--trace-memory`, what the replay allocated.
+
+    python -m benchmarks.replay pubsub.log.gz --speed 0 --profile replay.prof
+
+"""
+
+import argparse
+import asyncio
+import cProfile
+import json
+import logging
+import pstats
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Set, Tuple
+
+from signum import codec
+from signum.account import Account
+from signum.credentials import Credentials
+from signum.endpoints import Endpoints
+from signum.manager import Manager
+from signum.recorder import read_recording
+from signum.websocket.pubsub import Pubsub, PubsubReconnect
+
+from .fake_twitch import CLIENT_ID, FakeChannel, FakeTwitch
+
+# (seconds since recording started, frame, claim ID if it announces one)
+Frame = Tuple[float, str, Optional[str]]
+
+
+def load_frames(path: str) -> List[Frame]:
+    """ Read a recording, pulling out the claim IDs ahead of the replay. """
+    frames = []
+
+    for offset, frame in read_recording(path):
+        claim_id = None
+
+        if "claim-available" in frame:
+            message = codec.loads(codec.loads(frame)["data"]["message"])
+            claim_id = message["data"]["claim"]["id"]
+
+        frames.append((offset, frame, claim_id))
+
+    return frames
+
+
+def _channel_id(message: dict) -> Optional[str]:
+    data: dict = message.get("data") or {}
+
+    return message.get("channel_id") or data.get("channel_id") or (data.get("claim") or {}).get("channel_id")
+
+
+def find_ids(frames: List[Frame], channel_topics: Set[str]) -> Tuple[Set[int], Set[int]]:
+    """ The user IDs and channel IDs that the recorded messages refer to. """
+    user_ids, channel_ids = set(), set()
+
+    for _, frame, _ in frames:
+        data: dict = codec.loads(frame).get("data") or {}
+
+        if not data.get("topic") or not data.get("message"):
+            continue
+
+        topic, target_id = data["topic"].rsplit(".", 1)
+
+        if topic in channel_topics:
+            channel_ids.add(int(target_id))
+            continue
+
+        user_ids.add(int(target_id))
+        channel_id = _channel_id(codec.loads(data["message"]))
+
+        if channel_id:
+            channel_ids.add(int(channel_id))
+
+    return user_ids, channel_ids
+
+
+def make_account(user_id: int, endpoints: Endpoints) -> Account:
+    credentials = Credentials(None, f"token{user_id}", user_id, f"user{user_id}", f"unique{user_id}")
+
+    account = Account(credentials=credentials, endpoints=endpoints)
+    account.client_id = CLIENT_ID
+
+    return account
+
+
+def handler_times(profiler: cProfile.Profile, manager: Manager) -> Dict[str, dict]:
+    """ Calls and cumulative seconds of each handler, and of the dispatch path. """
+    functions = {
+        "pubsub.process": Pubsub.process,
+        "manager.decode": Manager._decode_event,
+        "manager.dispatch": Manager._update_event
+    }
+
+    for (topic, message_type), handler in manager._handlers.items():
+        functions[f"{topic}/{message_type}"] = handler
+
+    for (topic, message_type), handler in manager._channel_handlers.items():
+        functions[f"{topic}/{message_type}"] = handler
+
+    stats = pstats.Stats(profiler).stats
+    times = {}
+
+    for name, function in functions.items():
+        code = function.__code__
+        entry = stats.get((code.co_filename, code.co_firstlineno, code.co_name))
+
+        # Coroutines count a call each time they are resumed.
+        if entry is not None:
+            times[name] = {"calls": entry[1], "cpu_seconds": entry[3]}
+
+    return times
+
+
+async def run(args: argparse.Namespace) -> dict:
+    frames = load_frames(args.recording)
+
+    if not frames:
+        raise Exception(f"No frames were found in {args.recording}")
+
+    # Events only come from the recording, never from the server itself.
+    server = FakeTwitch(channel_count=0, event_interval=24 * 60 * 60, latency=args.latency)
+    endpoints = Endpoints.from_base_url(await server.start())
+
+    manager = Manager(
+        [],
+        endpoints=endpoints,
+        event_workers=args.event_workers,
+        event_queue_size=max(args.event_queue_size, 1),
+        host_rate=args.host_rate,
+        account_rate=args.account_rate,
+        poll_interval=0
+    )
+
+    user_ids, channel_ids = find_ids(frames, {topic for topic, _ in manager._channel_handlers})
+
+    for channel_id in sorted(channel_ids):
+        channel = FakeChannel(channel_id, f"channel{channel_id}")
+
+        server.channels[channel_id] = channel
+        server.channels_by_login[channel.login] = channel
+
+        manager.apply_channel_data(channel.to_gql())
+
+    for user_id in sorted(user_ids):
+        manager.add_account(make_account(user_id, endpoints))
+
+    # An unconnected socket, fed the recorded frames as if it received them.
+    pubsub = Pubsub(endpoints.pubsub)
+    pubsub.set_event_callback(manager._dispatcher.put)
+
+    manager._dispatcher.start()
+
+    # Timed by CPU rather than the wall clock, so that time spent waiting on
+    # the event loop isn't counted against whatever was last running.
+    profiler = cProfile.Profile(time.process_time) if not args.no_profile else None
+
+    if args.trace_memory:
+        tracemalloc.start()
+        memory_before = tracemalloc.take_snapshot()
+
+    cpu_started = time.process_time()
+    started = time.monotonic()
+    first_offset = frames[0][0]
+    reconnects = 0
+
+    if profiler is not None:
+        profiler.enable()
+
+    for offset, frame, claim_id in frames:
+        if args.speed > 0:
+            delay = started + (offset - first_offset) / args.speed - time.monotonic()
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        if claim_id is not None:
+            server.expect_claim(claim_id)
+
+        try:
+            await pubsub.process(frame)
+        except PubsubReconnect:
+            # Twitch sends these routinely, and there's no socket to reopen.
+            reconnects += 1
+
+    await manager._dispatcher.join()
+
+    # Claims are sent by the handlers, so wait for the last ones to land.
+    deadline = time.monotonic() + args.claim_timeout
+
+    while server._claims_sent and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+    if profiler is not None:
+        profiler.disable()
+
+    elapsed = time.monotonic() - started
+    cpu = time.process_time() - cpu_started
+
+    results = {
+        "frames": len(frames),
+        "reconnects": reconnects,
+        "accounts": len(user_ids),
+        "channels": len(channel_ids),
+        "speed": args.speed,
+        "recorded_seconds": frames[-1][0] - first_offset,
+        "replay_seconds": elapsed,
+        "frames_per_second": len(frames) / elapsed if elapsed else 0,
+        "cpu_seconds": cpu,
+        "cpu_us_per_frame": cpu / len(frames) * 1e6,
+        "dispatcher": manager._dispatcher.stats()
+    }
+
+    stats = server.stats()
+
+    results["claims"] = {
+        "sent": stats["claims_sent"],
+        "made": stats["claims_made"],
+        "latency_p50": stats["claim_latency_p50"],
+        "latency_p99": stats["claim_latency_p99"]
+    }
+
+    if profiler is not None:
+        results["handlers"] = handler_times(profiler, manager)
+
+        if args.profile:
+            profiler.dump_stats(args.profile)
+
+    if args.trace_memory:
+        differences = tracemalloc.take_snapshot().compare_to(memory_before, "lineno")
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results["memory"] = {
+            "allocated_kb": sum(difference.size_diff for difference in differences) / 1024,
+            "allocations": sum(difference.count_diff for difference in differences),
+            "peak_kb": peak / 1024,
+            "top": [
+                {"line": str(difference.traceback), "kb": difference.size_diff / 1024, "count": difference.count_diff}
+                for difference in differences[:args.top]
+            ]
+        }
+
+    await manager.close()
+    await server.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded PubSub traffic through Signum's dispatch path")
+
+    parser.add_argument("recording", type=str, help="File written by --record-pubsub")
+    parser.add_argument("--speed", type=float, default=1.0, help="Multiple of the recorded speed, 0 for as fast as possible")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the server waits before answering")
+    parser.add_argument("--host-rate", type=float, default=50, help="Requests per second to the server, as in the CLI")
+    parser.add_argument("--account-rate", type=float, default=5, help="Requests per second by each account, as in the CLI")
+    parser.add_argument("--event-workers", type=int, default=4)
+    parser.add_argument("--event-queue-size", type=int, default=100000, help="Large enough by default that nothing is dropped")
+    parser.add_argument("--claim-timeout", type=float, default=10.0, help="Seconds to wait for claims still in flight at the end")
+    parser.add_argument("--profile", type=str, default=None, help="Write the cProfile stats to this file")
+    parser.add_argument("--no-profile", action="store_true", help="Don't profile, which leaves the handler times out")
+    parser.add_argument("--trace-memory", action="store_true", help="Measure allocations with tracemalloc, which slows everything down")
+    parser.add_argument("--top", type=int, default=10, help="Lines to list in the allocation report")
+    parser.add_argument("-v", "--verbose", action="store_true")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
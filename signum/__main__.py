@@ -2,76 +2,166 @@ import argparse
 import asyncio
 import glob
 import logging
-import sys
-from typing import List, Tuple
 
 from .account import Account
+from .cache import config_cache
+from .control import ControlServer
+from .credentials import load_credentials
+from .endpoints import Endpoints, default_endpoints
+from .logs import configure_logging
 from .manager import Manager
+from .workers import run_workers
 
-log = logging.getLogger()
-log.setLevel(logging.DEBUG)
-
-class StreamFormatter(logging.Formatter):
-    base_format: List[str] = [
-        "[%(asctime)s]",
-        "%(message)s"
-    ]
-
-    extra_format: List[Tuple[str, str, int]] = [
-        ("channel", "[%(channel)s]", 1),
-        ("account", "[%(account)s]", 1)
-    ]
-
-    def format(self, record):
-        _old_format = self._style._fmt
-        _base_format = self.base_format.copy()
-
-        for attr, form, index in self.extra_format:
-            if hasattr(record, attr):
-                _base_format.insert(index, form)
-        
-        self._style._fmt = " ".join(_base_format)
-        result = super().format(record)
-        self._style._fmt = _old_format
-
-        return result
-
-stream_formatter = StreamFormatter(datefmt="%Y-%m-%d %H:%M:%S")
-
-stream_handler = logging.StreamHandler(sys.stdout)
-stream_handler.setFormatter(stream_formatter)
-stream_handler.setLevel(logging.INFO)
-
-file_formatter = logging.Formatter(
-    "%(created)i/%(name)s/%(levelname)s/%(account)s:%(channel)s/%(message)s",
-    defaults={
-        "account": "",
-        "channel": ""
-    }
-)
-
-file_handler = logging.FileHandler("debug.log")
-file_handler.setFormatter(file_formatter)
-file_handler.setLevel(logging.DEBUG)
-
-log.addHandler(stream_handler)
-log.addHandler(file_handler)
-
-logging.getLogger("charset_normalizer").setLevel(logging.ERROR)
+log = logging.getLogger(__name__)
 
 async def main():
     parser = argparse.ArgumentParser(description="Twitch channel point farmer")
 
     parser.add_argument("-j", "--cookies", type=str, required=False, default="cookies.txt", help="Pattern to find cookie files by")
     parser.add_argument("-c", "--channels", nargs="+", required=True, help="List of channels to watch")
+    parser.add_argument("-p", "--priority", nargs="+", default=[], metavar="CHANNEL=PRIORITY", help="Priorities for channels, higher are watched first")
+    parser.add_argument("--max-channels", type=int, default=2, help="Maximum channels each account watches at once")
+    parser.add_argument("--connection-limit", type=int, default=100, help="Maximum open connections shared by all accounts")
+    parser.add_argument("--connection-limit-per-host", type=int, default=50, help="Maximum open connections to a single host")
+    parser.add_argument("--cache-file", type=str, default=None, help="File to keep the client ID and Spade URL in between runs")
+    parser.add_argument("--cache-ttl", type=float, default=6 * 60 * 60, help="Seconds before the client ID and Spade URL are fetched again")
+    parser.add_argument("--startup-concurrency", type=int, default=20, help="Maximum accounts initialized at once")
+    parser.add_argument("--spade-batch-size", type=int, default=10, help="Maximum minute-watched events sent in one request, 1 to disable batching")
+    parser.add_argument("--max-in-flight", type=int, default=50, help="Maximum watch requests running at once")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this local port")
+    parser.add_argument("--metrics-file", type=str, default=None, help="File to write Prometheus metrics to periodically")
+    parser.add_argument("--metrics-interval", type=float, default=60.0, help="Seconds between writes of the metrics file")
+    parser.add_argument("--snapshot-file", type=str, default=None, help="File to keep channel and follow state in for quicker restarts")
+    parser.add_argument("--snapshot-max-age", type=float, default=10 * 60, help="Seconds before snapshot state is checked again at startup")
+    parser.add_argument("--host-rate", type=float, default=50, help="Maximum requests per second to each Twitch host, shared by all accounts")
+    parser.add_argument("--account-rate", type=float, default=5, help="Maximum requests per second each account makes to a host")
+    parser.add_argument("--max-concurrency", type=float, default=50, help="Most requests in flight to each Twitch host, which the limit grows towards while responses are quick")
+    parser.add_argument("--latency-target", type=float, default=1.0, help="Seconds a response can take and still let the limit on requests in flight grow")
+    parser.add_argument("--max-retries", type=int, default=3, help="Times a rate limited or failed request is retried")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="Seconds between checks of every channel's stream in case PubSub misses one, 0 to disable")
+    parser.add_argument("--max-poll-interval", type=float, default=600.0, help="Longest the checks back off to while they find nothing wrong")
+    parser.add_argument("--log-file", type=str, default="debug.log", help="File to write debug logs to")
+    parser.add_argument("--log-max-bytes", type=int, default=10 * 1024 * 1024, help="Size at which the debug log is rotated")
+    parser.add_argument("--log-backups", type=int, default=5, help="Number of rotated debug logs to keep")
+    parser.add_argument("--log-sample", type=int, default=1, help="Keep one in this many debug messages about PubSub messages")
+    parser.add_argument("--sync-logging", action="store_true", help="Write logs on the event loop rather than a background thread")
+    parser.add_argument("--control-port", type=int, default=None, help="Serve an API for adding and removing accounts and channels on this local port")
+    parser.add_argument("--credential-store", type=str, default=None, help="File to keep parsed cookies in, so unchanged cookie files aren't parsed again. Accounts loaded from it only send the auth-token, login and unique_id cookies")
+    parser.add_argument("--load-threads", type=int, default=8, help="Threads used to read cookie files")
+    parser.add_argument("--record-pubsub", type=str, default=None, help="File to record every PubSub message to, for replaying with benchmarks/replay.py")
+    parser.add_argument("--base-url", type=str, default=None, help="Send every request to a stand-in Twitch server at this URL")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of processes to spread the accounts over")
+    parser.add_argument("--event-workers", type=int, default=4, help="Number of tasks handling PubSub messages")
+    parser.add_argument("--event-queue-size", type=int, default=1000, help="Maximum PubSub messages waiting per worker")
 
     args = parser.parse_args()
 
-    manager = Manager(args.channels)
+    listener = configure_logging(
+        log_file=args.log_file,
+        max_bytes=args.log_max_bytes,
+        backup_count=args.log_backups,
+        sample_rate=args.log_sample,
+        use_queue=not args.sync_logging
+    )
+
+    try:
+        await _run(args)
+    finally:
+        if listener is not None:
+            listener.stop()
+
+async def _run(args: argparse.Namespace) -> None:
+    channel_priorities = {}
+
+    for entry in args.priority:
+        name, _, priority = entry.partition("=")
+        channel_priorities[name] = int(priority or 0)
+
+    cache_options = {
+        "ttl": args.cache_ttl,
+        "path": args.cache_file
+    }
 
-    for file in glob.glob(args.cookies):
-        manager.accounts.append(Account(file))
+    config_cache.configure(**cache_options)
+
+    endpoints = Endpoints.from_base_url(args.base_url) if args.base_url else default_endpoints
+
+    manager_options = {
+        "endpoints": endpoints,
+        "connection_limit": args.connection_limit,
+        "connection_limit_per_host": args.connection_limit_per_host,
+        "startup_concurrency": args.startup_concurrency,
+        "event_workers": args.event_workers,
+        "event_queue_size": args.event_queue_size,
+        "max_in_flight": args.max_in_flight,
+        "max_channels": args.max_channels,
+        "channel_priorities": channel_priorities,
+        "metrics_port": args.metrics_port,
+        "metrics_file": args.metrics_file,
+        "metrics_interval": args.metrics_interval,
+        "snapshot_file": args.snapshot_file,
+        "snapshot_max_age": args.snapshot_max_age,
+        "host_rate": args.host_rate,
+        "account_rate": args.account_rate,
+        "max_concurrency": args.max_concurrency,
+        "latency_target": args.latency_target,
+        "poll_interval": args.poll_interval,
+        "max_poll_interval": args.max_poll_interval,
+        "record_file": args.record_pubsub
+    }
 
-    await manager.run()
+    account_options = {
+        "spade_batch_size": args.spade_batch_size,
+        "max_retries": args.max_retries,
+        "endpoints": endpoints
+    }
 
-asyncio.run(main())
+    credentials = await load_credentials(
+        glob.glob(args.cookies),
+        store_path=args.credential_store,
+        threads=args.load_threads
+    )
+
+    if args.workers > 1:
+        if args.control_port is not None:
+            log.warning("The control API isn't available with --workers")
+
+        await run_workers(
+            credentials,
+            args.channels,
+            args.workers,
+            manager_options,
+            account_options,
+            cache_options,
+            log_sample=args.log_sample
+        )
+        return
+
+    manager = Manager(args.channels, **manager_options)
+
+    for account_credentials in credentials:
+        manager.add_account(Account(credentials=account_credentials, **account_options))
+
+    if args.control_port is None:
+        await manager.run()
+        return
+
+    control = ControlServer(
+        manager,
+        lambda cookie_file: Account(cookie_file, **account_options),
+        port=args.control_port
+    )
+
+    await control.start()
+
+    try:
+        await manager.run()
+    finally:
+        await control.close()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except asyncio.CancelledError:
+        # Stopped by SIGTERM with --workers, once the workers have exited.
+        pass
@@ -2,62 +2,221 @@ import asyncio
 import json
 import logging
 import re
+import time
 import urllib.parse
 from base64 import b64encode
-from http.cookiejar import MozillaCookieJar
-from typing import Optional
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
 
 import aiohttp
 
-from .websocket.pubsub import Pubsub
+from .websocket.pubsub import PubsubPool
 
+from . import codec
+from .batch import GqlBatcher
+from .cache import config_cache
+from .endpoints import Endpoints, default_endpoints
 from .channel import Channel
+from .credentials import Credentials
 from .gql import operations, hashes
+from .ratelimit import (
+    PRIORITY_CHECK, PRIORITY_CLAIM, PRIORITY_WATCH, ConcurrencyLimiter, RateLimiter, parse_retry_after
+)
+from .metrics import (
+    GQL_BATCH_SIZE, GQL_OPERATION_SECONDS, GQL_OPERATIONS, GQL_REQUESTS,
+    SPADE_EVENTS, SPADE_POSTS, SPADE_SECONDS
+)
 
 log = logging.getLogger(__name__)
 
+QUERY_NAME_PATTERN = re.compile(r"^\s*(?:query|mutation)\s+(\w+)")
+
+
+def _selection(query: str, field: str) -> str:
+    """ The `{ ... }` block that follows `field` in a query. """
+    start = query.index("{", query.index(field))
+    depth = 0
+
+    for index in range(start, len(query)):
+        if query[index] == "{":
+            depth += 1
+        elif query[index] == "}":
+            depth -= 1
+
+            if depth == 0:
+                return query[start:index + 1]
+
+    raise ValueError(f"Unbalanced braces after {field}")
+
+
+# The fields `find_channel` asks for, reused for several channels at once.
+USER_SELECTION = _selection(operations["find_channel"], "user(login: $login)")
+
+
+def find_channels_query(channel_names: List[str]) -> str:
+    """ One query that looks up every channel, aliased as c0, c1 and so on. """
+    fields = "\n".join(
+        f"  c{index}: user(login: {json.dumps(channel_name)}) {USER_SELECTION}"
+        for index, channel_name in enumerate(channel_names)
+    )
+
+    return f"query findChannels {{\n{fields}\n}}"
+
+# Statuses that mean Spade won't take several events in one request.
+SPADE_REJECTED_STATUSES = (400, 413, 422)
+
+# Longest wait between retries when Twitch doesn't give a Retry-After.
+MAX_RETRY_DELAY = 30
+
+T = TypeVar("T")
+
 
 class Account:
     def __init__(
         self,
         cookie_file: str = None,
-        default_headers: Optional[dict] = None
+        default_headers: Optional[dict] = None,
+        connector: Optional[aiohttp.BaseConnector] = None,
+        gql_batch_size: int = 20,
+        gql_batch_window: float = 0.01,
+        spade_batch_size: int = 10,
+        endpoints: Optional[Endpoints] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_retries: int = 3,
+        credentials: Optional[Credentials] = None,
+        concurrency_limiter: Optional[ConcurrencyLimiter] = None
     ):
         self._cookie_jar = {}
         self._default_headers = default_headers
 
-        self._websocket: Optional[Pubsub] = None
+        self.endpoints = endpoints or default_endpoints
 
-        if cookie_file:
-            cookie_jar = MozillaCookieJar()
-            cookie_jar.load(cookie_file)
+        self._connector: Optional[aiohttp.BaseConnector] = connector
+        self._session: Optional[aiohttp.ClientSession] = None
 
-            for cookie in cookie_jar:
-                self._cookie_jar[cookie.name] = cookie.value
+        self._rate_limiter = rate_limiter
+        self._concurrency_limiter = concurrency_limiter
+        self.max_retries = max(0, max_retries)
+
+        self._gql_batcher = GqlBatcher(
+            self._post_twitch_gql,
+            max_size=gql_batch_size,
+            window=gql_batch_window
+        )
+
+        self._pubsub: Optional[PubsubPool] = None
+
+        self.spade_batch_size = max(1, spade_batch_size)
+        self._spade_batching = True
+
+        self.spade_failures: Dict[int, int] = {}
+
+        # Credentials loaded ahead of time save parsing the cookie file here.
+        if credentials is None and cookie_file:
+            credentials = Credentials.from_file(cookie_file)
 
-        self._spade_url: Optional[str] = None
-        
         self.username: Optional[str] = None
         self.authorization_token: Optional[str] = None
 
         self.unique_id: Optional[str] = None
-        self.user_id: Optional[str] = None
+        self.user_id: Optional[int] = None
         self.client_id: Optional[str] = None
 
+        if credentials is not None:
+            self._cookie_jar = credentials.cookies
+
+            self.username = credentials.username
+            self.authorization_token = credentials.authorization_token
+            self.unique_id = credentials.unique_id
+            self.user_id = credentials.user_id
+
     @property
     def session(self) -> aiohttp.ClientSession:
-        return aiohttp.ClientSession(
-            headers=self._default_headers,
-            cookies=self._cookie_jar
-        )
+        """
+        The account's long-lived session, created on first use. The connector
+        may be shared with other accounts, but each session keeps its own
+        cookie jar.
+        """
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=self._connector,
+                connector_owner=self._connector is None,
+                headers=self._default_headers,
+                cookies=self._cookie_jar,
+                json_serialize=codec.dumps
+            )
+
+        return self._session
+
+    def set_connector(self, connector: aiohttp.BaseConnector) -> None:
+        """ Use a shared connection pool for any sessions created from now on. """
+        self._connector = connector
+
+    def set_rate_limiter(self, rate_limiter: RateLimiter) -> None:
+        """ Share request budgets with other accounts. """
+        self._rate_limiter = rate_limiter
+
+    def set_concurrency_limiter(self, concurrency_limiter: ConcurrencyLimiter) -> None:
+        """ Share the limits on requests in flight with other accounts. """
+        self._concurrency_limiter = concurrency_limiter
+
+    async def close(self) -> None:
+        """ Close the account's session. A shared connector is left open. """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+        self._session = None
     
+    async def _send(self, url: str, priority: int, request: Callable[[], Awaitable[T]]) -> T:
+        """
+        Make a request within the rate and concurrency limits. Responses of
+        429 or a server error are retried up to `max_retries` times, waiting
+        as long as the Retry-After header asks; a 429 holds back every
+        request to the host.
+        """
+        host = urllib.parse.urlsplit(url).netloc
+
+        async def limited() -> T:
+            if self._concurrency_limiter is None:
+                return await request()
+
+            async with self._concurrency_limiter.slot(host, priority):
+                return await request()
+
+        for attempt in range(self.max_retries + 1):
+            if self._rate_limiter is not None:
+                await self._rate_limiter.acquire(host, self.user_id, priority)
+
+            try:
+                return await limited()
+            except aiohttp.ClientResponseError as error:
+                if attempt >= self.max_retries or not (error.status == 429 or error.status >= 500):
+                    raise
+
+                delay = parse_retry_after(error.headers and error.headers.get("Retry-After"))
+
+                if delay is None:
+                    delay = min(MAX_RETRY_DELAY, 2 ** attempt)
+
+                log.warning(f"Got {error.status} from {host}, retrying in {delay:.1f}s", extra={
+                    "account": self.username
+                })
+
+                if error.status == 429 and self._rate_limiter is not None:
+                    self._rate_limiter.pause(host, delay)
+                else:
+                    await asyncio.sleep(delay)
+
     async def fetch_twitch_gql(
         self,
         query_or_hash: str,
         variables: Optional[dict] = None,
-        is_persisted: bool = False
+        is_persisted: bool = False,
+        priority: int = PRIORITY_CHECK
     ) -> dict:
-        """ Perform a GraphQL request on Twitch's API. """
+        """
+        Perform a GraphQL request on Twitch's API. Operations made at the same
+        time are sent together in one request.
+        """
         data = {}
 
         if is_persisted:
@@ -76,23 +235,55 @@ class Account:
         if variables:
             data["variables"] = variables
 
+        if is_persisted:
+            operation_name = query_or_hash
+        else:
+            search = QUERY_NAME_PATTERN.match(query_or_hash)
+            operation_name = search.group(1) if search else "query"
+
+        started = time.perf_counter()
+
+        try:
+            result = await self._gql_batcher.submit(data, priority)
+        except Exception:
+            GQL_OPERATIONS.inc(operation_name, "error")
+            raise
+
+        GQL_OPERATIONS.inc(operation_name, "ok")
+        GQL_OPERATION_SECONDS.observe(time.perf_counter() - started, operation_name)
+
+        return result
+
+    async def _post_twitch_gql(self, operations: List[dict], priority: int = PRIORITY_CHECK) -> List[dict]:
+        """ Send a list of GraphQL operations in a single request. """
         headers = {
             "Authorization": f"OAuth {self.authorization_token}",
             "Client-ID": self.client_id,
         }
 
-        async with self.session as session:
-            async with session.post("https://gql.twitch.tv/gql", json=[data], headers=headers, raise_for_status=True) as resp:
-                return (await resp.json())[0]["data"]
+        GQL_BATCH_SIZE.observe(len(operations))
+
+        async def post() -> List[dict]:
+            try:
+                async with self.session.post(self.endpoints.gql, json=operations, headers=headers, raise_for_status=True) as resp:
+                    results = await resp.json(loads=codec.loads)
+            except Exception:
+                GQL_REQUESTS.inc("error")
+                raise
+
+            GQL_REQUESTS.inc("ok")
+
+            return results
+
+        return await self._send(self.endpoints.gql, priority, post)
     
     async def fetch_client_id(self) -> Optional[str]:
         """
         Find the current client ID from the Twitch home page. Cookies must be
         set before this can be called.
         """
-        async with self.session as session:
-            async with session.get("https://www.twitch.tv/", raise_for_status=True) as resp:
-                text = await resp.text()
+        async with self.session.get(self.endpoints.home, raise_for_status=True) as resp:
+            text = await resp.text()
 
         search = re.search(r"\"Client-ID\":\"(.*?)\"", text)
 
@@ -123,50 +314,49 @@ class Account:
 
         return user
     
-    async def get_spade_url(self) -> str:
-        """ Get the Spade URL. If it is not set, fetch it. """
-        if self._spade_url:
-            return self._spade_url
-
-        async with self.session as session:
-            async with session.get("https://static.twitchcdn.net/config/settings.js", raise_for_status=True) as resp:
-                data: dict = json.loads((await resp.text())[28:])
+    async def fetch_channels(self, channel_names: List[str]) -> Dict[str, Optional[dict]]:
+        """
+        Find several channels in a single query. Channels that don't exist
+        map to None.
+        """
+        data = await self.fetch_twitch_gql(find_channels_query(channel_names))
 
-        self._spade_url = data.get("spade_url")
+        return {
+            channel_name: data.get(f"c{index}")
+            for index, channel_name in enumerate(channel_names)
+        }
 
-        return self._spade_url
+    async def get_spade_url(self) -> str:
+        """ Get the Spade URL, which is shared by every account. """
+        return await config_cache.get("spade_url", self.fetch_spade_url)
 
-    async def initialize_user(self) -> None:
-        """ Update the user's authentication and then find the client ID. """
-        for name, value in self._cookie_jar.items():
-            if name == "twilight-user":
-                data: str = urllib.parse.unquote(str(value))
-                data: dict = json.loads(data)
+    async def fetch_spade_url(self) -> Optional[str]:
+        """ Find the current Spade URL from Twitch's settings file. """
+        async with self.session.get(self.endpoints.settings, raise_for_status=True) as resp:
+            data: dict = codec.loads((await resp.text())[28:])
 
-                self.authorization_token = data.get("authToken")
-                self.user_id = int(data.get("id"))
+        return data.get("spade_url")
 
-            elif name == "login":
-                self.username = value
+    async def initialize_user(self) -> None:
+        """ Check the user's authentication and then find the client ID. """
+        if self.user_id is None or self.authorization_token is None:
+            raise Exception("The cookies have no twilight-user cookie to sign in with")
 
-            elif name == "unique_id":
-                self.unique_id = value
-        
-        self.client_id = await self.fetch_client_id()
+        self.client_id = await config_cache.get("client_id", self.fetch_client_id)
     
-    async def initialize_websocket(self, function) -> None:
-        self._websocket = Pubsub()
-
-        if function:
-            self._websocket.set_event_callback(function)
-        
-        asyncio.get_event_loop().create_task(self._websocket.run())
-        
-        while not self._websocket.initialized:
-            await asyncio.sleep(1)
-
-        await self._websocket.listen("stream-change-v1", self.user_id, self.authorization_token)
-        await self._websocket.listen("community-points-user-v1", self.user_id, self.authorization_token)
+    @property
+    def topics(self) -> List[str]:
+        """ The PubSub topics the account listens to. """
+        return [
+            f"stream-change-v1.{self.user_id}",
+            f"community-points-user-v1.{self.user_id}"
+        ]
+
+    async def initialize_websocket(self, pubsub: PubsubPool, function) -> None:
+        """ Listen to the account's topics on the shared PubSub pool. """
+        self._pubsub = pubsub
+
+        await pubsub.listen(self.topics, self.authorization_token, function)
     
     async def is_following(self, channel: Channel) -> bool:
         """ See if the account is following the given channel. """
@@ -197,7 +387,7 @@ class Account:
                 "channelID": str(channel.id),
                 "claimID": claim_id
             }
-        }, is_persisted=True)
+        }, is_persisted=True, priority=PRIORITY_CLAIM)
 
         log.info(f"Claimed 50 channel points", extra={
             "channel": channel.name,
@@ -217,15 +407,8 @@ class Account:
         
         return points["availableClaim"]["id"]
     
-    async def watch_minute(self, channel: Channel) -> None:
-        """
-        Watch one minute of the given broadcast on the given channel.
-        
-        :param channel_id: ID of the channel.
-        :param broadcast_id: ID of the specific broadcast.
-        """
-
-        data = {
+    def _minute_watched_event(self, channel: Channel) -> dict:
+        return {
             "event": "minute-watched",
             "properties": {
                 "channel_id": channel.id,
@@ -235,14 +418,98 @@ class Account:
             }
         }
 
-        async with self.session as session:
-            await session.post(
-                await self.get_spade_url(),
-                data=b64encode(json.dumps([data]).encode("utf-8")),
-                raise_for_status=True
-            )
+    async def _post_spade(self, events: List[dict]) -> None:
+        """ Send a list of events to Spade in a single request. """
+        spade_url = await self.get_spade_url()
+        data = b64encode(codec.dumps_bytes(events))
+
+        async def post() -> None:
+            started = time.perf_counter()
+
+            try:
+                async with self.session.post(spade_url, data=data, raise_for_status=True):
+                    pass
+            except Exception:
+                SPADE_POSTS.inc("error")
+                raise
+
+            SPADE_POSTS.inc("ok")
+            SPADE_EVENTS.inc(amount=len(events))
+            SPADE_SECONDS.observe(time.perf_counter() - started)
 
+        await self._send(spade_url, PRIORITY_WATCH, post)
+
+    def _watched(self, channel: Channel) -> None:
         log.info(f"Watched one minute", extra={
             "channel": channel.display_name,
             "account": self.username
         })
+
+    def _watch_failed(self, channel: Channel, error: Exception) -> None:
+        self.spade_failures[channel.id] = self.spade_failures.get(channel.id, 0) + 1
+
+        log.warning(f"Failed to watch one minute: {error!r}", extra={
+            "channel": channel.display_name,
+            "account": self.username
+        })
+
+    async def watch_minute(self, channel: Channel) -> None:
+        """
+        Watch one minute of the given broadcast on the given channel.
+        
+        :param channel_id: ID of the channel.
+        :param broadcast_id: ID of the specific broadcast.
+        """
+        await self._post_spade([self._minute_watched_event(channel)])
+
+        self._watched(channel)
+
+    async def watch_minutes(self, channels: List[Channel]) -> None:
+        """
+        Watch one minute on each of the given channels, sending up to
+        `spade_batch_size` events per request. If Spade rejects a batch, the
+        account goes back to sending each event on its own. Failures are
+        counted per channel rather than raised. Channels that have stopped
+        streaming by the time their events are sent are skipped.
+        """
+        size = self.spade_batch_size if self._spade_batching else 1
+
+        for index in range(0, len(channels), size):
+            # Checked for each chunk, as streams can end while this is sending.
+            chunk = [channel for channel in channels[index:index + size] if channel.is_streaming]
+
+            if len(chunk) > 1:
+                try:
+                    await self._post_spade([
+                        self._minute_watched_event(channel) for channel in chunk
+                    ])
+
+                except aiohttp.ClientResponseError as error:
+                    if error.status not in SPADE_REJECTED_STATUSES:
+                        for channel in chunk:
+                            self._watch_failed(channel, error)
+
+                        continue
+
+                    log.warning(f"Spade rejected a batch ({error.status}), sending events one at a time", extra={
+                        "account": self.username
+                    })
+                    self._spade_batching = False
+
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    for channel in chunk:
+                        self._watch_failed(channel, error)
+
+                    continue
+
+                else:
+                    for channel in chunk:
+                        self._watched(channel)
+
+                    continue
+
+            for channel in chunk:
+                try:
+                    await self.watch_minute(channel)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    self._watch_failed(channel, error)
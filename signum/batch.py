@@ -0,0 +1,105 @@
+"""
+
+Coalesces the GraphQL operations made by one account into a single request.
+Twitch's GQL endpoint accepts a list of operations and answers with a list of
+results in the same order, so operations made within a short window of each
+other are sent together and each result is handed back to its own caller.
+A batch is sent at the most urgent priority of the operations in it.
+
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+
+class GqlError(Exception):
+    """ Raised for a single operation that Twitch answered with errors. """
+    def __init__(self, errors: List[dict]):
+        self.errors = errors
+
+        super().__init__("; ".join(
+            str(error.get("message", error)) for error in errors
+        ))
+
+
+class GqlBatcher:
+    def __init__(
+        self,
+        send: Callable[[List[dict], int], Awaitable[List[dict]]],
+        max_size: int = 20,
+        window: float = 0.01
+    ):
+        self._send = send
+
+        self.max_size = max(1, max_size)
+        self.window = window
+
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._priority: Optional[int] = None
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, operation: dict, priority: int = 0) -> dict:
+        """ Queue an operation for the next batch and wait for its data. """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        self._pending.append((operation, future))
+
+        if self._priority is None or priority < self._priority:
+            self._priority = priority
+
+        if len(self._pending) >= self.max_size or self.window <= 0:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        priority, self._priority = self._priority, None
+
+        if not batch:
+            return
+
+        task = asyncio.get_running_loop().create_task(self._dispatch(batch, priority))
+
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch: List[Tuple[dict, asyncio.Future]], priority: int) -> None:
+        try:
+            results = await self._send([operation for operation, _ in batch], priority)
+        except Exception as error:
+            # The whole request failed, so every caller in it sees the error.
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+            return
+
+        log.debug(f"Sent {len(batch)} GQL operation(s) in one request")
+
+        for index, (operation, future) in enumerate(batch):
+            if future.done():
+                continue
+
+            result = results[index] if index < len(results) else None
+
+            if result is None:
+                future.set_exception(GqlError([{"message": "Missing result in batch response"}]))
+            elif result.get("data") is None:
+                future.set_exception(GqlError(result.get("errors") or [{"message": "No data returned"}]))
+            else:
+                if result.get("errors"):
+                    log.debug(f"Partial errors for {operation.get('operationName')}: {result['errors']}")
+
+                future.set_result(result["data"])
@@ -0,0 +1,126 @@
+"""
+
+Process-wide cache for values that are the same for every account, such as
+the client ID and the Spade URL. Concurrent lookups of a missing value share
+a single fetch, and values can be kept in a file so that restarts can skip
+fetching them until they expire.
+
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+log = logging.getLogger(__name__)
+
+
+class ValueCache:
+    def __init__(self, ttl: float = 6 * 60 * 60, path: Optional[str] = None):
+        self.ttl = ttl
+        self.path = path
+
+        # Key to a (value, expiry timestamp) pair.
+        self._values: Dict[str, tuple] = {}
+        self._fetches: Dict[str, asyncio.Task] = {}
+
+    def configure(self, ttl: Optional[float] = None, path: Optional[str] = None) -> None:
+        """ Change the TTL or cache file, loading the file if it exists. """
+        if ttl is not None:
+            self.ttl = ttl
+
+        if path is not None:
+            self.path = path
+            self.load()
+
+    def load(self) -> None:
+        if not self.path or not os.path.isfile(self.path):
+            return
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as file_object:
+                data: dict = json.load(file_object)
+        except (OSError, ValueError) as error:
+            log.warning(f"Failed to read cache file {self.path}: {error}")
+            return
+
+        now = time.time()
+
+        for key, entry in data.items():
+            if entry.get("expires", 0) > now:
+                self._values[key] = (entry["value"], entry["expires"])
+
+    def save(self) -> None:
+        """
+        Write the cache, replacing the old file all at once. Every worker
+        process shares the file, so each writes through its own temporary
+        file and a reader never sees a half written one.
+        """
+        if not self.path:
+            return
+
+        data = {
+            key: {"value": value, "expires": expires}
+            for key, (value, expires) in self._values.items()
+        }
+
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+
+        try:
+            with open(temporary_path, "w", encoding="utf-8") as file_object:
+                json.dump(data, file_object)
+
+            os.replace(temporary_path, self.path)
+        except OSError as error:
+            log.warning(f"Failed to write cache file {self.path}: {error}")
+
+    def peek(self, key: str) -> Optional[Any]:
+        """ Get a value if it is cached and has not expired. """
+        entry = self._values.get(key)
+
+        if entry is None or entry[1] <= time.time():
+            return None
+
+        return entry[0]
+
+    def set(self, key: str, value: Any) -> None:
+        self._values[key] = (value, time.time() + self.ttl)
+        self.save()
+
+    def invalidate(self, key: str) -> None:
+        self._values.pop(key, None)
+        self.save()
+
+    async def get(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+        """
+        Get a value, calling `fetch` if it is missing or expired. Callers that
+        ask for the same key while a fetch is running wait on that fetch.
+        """
+        value = self.peek(key)
+
+        if value is not None:
+            return value
+
+        task = self._fetches.get(key)
+
+        if task is None:
+            task = asyncio.get_running_loop().create_task(fetch())
+            task.add_done_callback(lambda done: self._store(key, done))
+
+            self._fetches[key] = task
+
+        return await asyncio.shield(task)
+
+    def _store(self, key: str, task: asyncio.Task) -> None:
+        self._fetches.pop(key, None)
+
+        if task.cancelled() or task.exception() is not None:
+            return
+
+        if task.result() is not None:
+            self.set(key, task.result())
+
+
+config_cache = ValueCache()
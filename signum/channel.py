@@ -1,13 +1,44 @@
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, timedelta
+from typing import Optional, Set
+
+EPOCH = datetime(1970, 1, 1)
 
 def process_time_string(date_string: str) -> datetime:
+    # Twitch's timestamps are always UTC, so the common shapes go through
+    # `fromisoformat`, which is far quicker than `strptime`.
+    if date_string.endswith("Z"):
+        try:
+            return datetime.fromisoformat(date_string[:-1])
+        except ValueError:
+            pass
+
     try:
         return datetime.strptime(date_string, "%Y-%m-%dT%H:%M:%S.%fZ")
     except ValueError:
         return datetime.strptime(date_string, "%Y-%m-%dT%H:%M:%SZ")
 
-class Stream:
+def format_time(date: Optional[datetime]) -> Optional[str]:
+    """ The opposite of `process_time_string`. """
+    return date.strftime("%Y-%m-%dT%H:%M:%S.%fZ") if date else None
+
+def _pack_time(date: Optional[datetime]) -> Optional[float]:
+    return (date - EPOCH).total_seconds() if date else None
+
+def _unpack_time(seconds: Optional[float]) -> Optional[datetime]:
+    return EPOCH + timedelta(seconds=seconds) if seconds is not None else None
+
+class _Model:
+    __slots__ = ()
+
+    def _set(self, name: str, value, changed: Set[str]) -> None:
+        """ Set a field, noting its name if the value is different. """
+        if getattr(self, name) != value:
+            setattr(self, name, value)
+            changed.add(name)
+
+class Stream(_Model):
+    __slots__ = ("id", "title", "type", "viewers_count", "created_at", "game_name")
+
     def __init__(self, data: dict = None):
         self.id: int = None
         self.title: str = None
@@ -17,27 +48,72 @@ class Stream:
         self.game_name: str = None
 
         if data: self.update(data)
-    
-    def update(self, data: dict) -> None:
-        """ Update the Stream object based on Twitch GQL data. """
-        self.id = int(data["id"]) if data.get("id") else None
-        self.viewers_count = int(data["viewersCount"]) if data.get("viewersCount") else None
 
-        self.title = data.get("title")
-        self.type = data.get("type")
+    def update(self, data: dict) -> Set[str]:
+        """
+        Update the Stream object in place based on Twitch GQL data, and return
+        the names of the fields that changed.
+        """
+        changed = set()
 
-        if data.get("createdAt"):
-            self.created_at = process_time_string(data["createdAt"])
-        
-        if data.get("game"):
-            self.game_name = data["game"]["name"]
+        self._set("id", int(data["id"]) if data.get("id") else None, changed)
+        self._set("viewers_count", int(data["viewersCount"]) if data.get("viewersCount") else None, changed)
+
+        self._set("title", data.get("title"), changed)
+        self._set("type", data.get("type"), changed)
+
+        created_at = data.get("createdAt")
+        self._set("created_at", process_time_string(created_at) if created_at else None, changed)
+
+        game = data.get("game")
+        self._set("game_name", game["name"] if game else None, changed)
+
+        return changed
+
+    def merge(self, other: "Stream") -> Set[str]:
+        """ Copy another stream's fields, returning the names that changed. """
+        changed = set()
+
+        for name in Stream.__slots__:
+            self._set(name, getattr(other, name), changed)
+
+        return changed
+
+    def to_dict(self) -> dict:
+        """ The stream as Twitch GQL data, which `update` can read back. """
+        return {
+            "id": str(self.id) if self.id else None,
+            "title": self.title,
+            "type": self.type,
+            "viewersCount": self.viewers_count,
+            "createdAt": format_time(self.created_at),
+            "game": {"name": self.game_name} if self.game_name else None
+        }
+
+    def pack(self) -> tuple:
+        """ A compact copy of the stream, for sending between processes. """
+        return (
+            self.id, self.title, self.type, self.viewers_count,
+            _pack_time(self.created_at), self.game_name
+        )
+
+    @classmethod
+    def unpack(cls, packed: tuple) -> "Stream":
+        stream = cls()
+        stream.id, stream.title, stream.type, stream.viewers_count, created_at, stream.game_name = packed
+        stream.created_at = _unpack_time(created_at)
+
+        return stream
+
+class Channel(_Model):
+    __slots__ = ("id", "name", "display_name", "created_at", "is_partner", "stream")
 
-class Channel:
     def __init__(self, data: dict = None):
         self.id: int = None
         self.name: str = None
         self.display_name: str = None
-        self.created_at: str = None
+        self.created_at: datetime = None
+        self.is_partner: bool = False
         self.stream: Optional[Stream] = None
 
         if data: self.update(data)
@@ -46,17 +122,85 @@ class Channel:
     def is_streaming(self) -> bool:
         return self.stream is not None
 
-    def update(self, data: dict) -> None:
-        """ Update the Channel object based on Twitch GQL data. """
-        self.id = int(data["id"]) if data.get("id") else None
+    def update(self, data: dict) -> Set[str]:
+        """
+        Update the Channel object in place based on Twitch GQL data, and
+        return the names of the fields that changed. A live stream is updated
+        rather than replaced, and its changes are named as `stream.<field>`.
+        """
+        changed = set()
+
+        self._set("id", int(data["id"]) if data.get("id") else None, changed)
 
-        self.name = data.get("login")
-        self.display_name = data.get("displayName")
+        self._set("name", data.get("login"), changed)
+        self._set("display_name", data.get("displayName"), changed)
 
         if data.get("createdAt"):
-            self.created_at = process_time_string(data["createdAt"])
+            self._set("created_at", process_time_string(data["createdAt"]), changed)
 
-        self.is_partner = data.get("roles", {}).get("isPartner", False)
+        self._set("is_partner", (data.get("roles") or {}).get("isPartner", False), changed)
 
         if data.get("stream") is not None:
-            self.stream = Stream(data["stream"])
+            if self.stream is None:
+                self.stream = Stream(data["stream"])
+                changed.add("stream")
+            else:
+                changed.update(f"stream.{name}" for name in self.stream.update(data["stream"]))
+
+        elif "stream" in data and self.stream is not None:
+            self.stream = None
+            changed.add("stream")
+
+        return changed
+
+    def merge(self, other: "Channel") -> Set[str]:
+        """ Copy another channel's state, such as one unpacked from another process. """
+        changed = set()
+
+        for name in ("id", "name", "display_name", "created_at", "is_partner"):
+            self._set(name, getattr(other, name), changed)
+
+        if other.stream is None:
+            if self.stream is not None:
+                self.stream = None
+                changed.add("stream")
+
+        elif self.stream is None:
+            self.stream = other.stream
+            changed.add("stream")
+
+        else:
+            changed.update(f"stream.{name}" for name in self.stream.merge(other.stream))
+
+        return changed
+
+    def to_dict(self) -> dict:
+        """ The channel as Twitch GQL data, which `update` can read back. """
+        return {
+            "id": str(self.id) if self.id else None,
+            "login": self.name,
+            "displayName": self.display_name,
+            "createdAt": format_time(self.created_at),
+            "roles": {"isPartner": self.is_partner},
+            "stream": self.stream.to_dict() if self.stream else None
+        }
+
+    def pack(self) -> tuple:
+        """
+        A compact copy of the channel, for sending between processes. It is
+        a plain tuple, so it pickles far smaller than the GQL data.
+        """
+        return (
+            self.id, self.name, self.display_name, _pack_time(self.created_at),
+            self.is_partner, self.stream.pack() if self.stream else None
+        )
+
+    @classmethod
+    def unpack(cls, packed: tuple) -> "Channel":
+        channel = cls()
+        channel.id, channel.name, channel.display_name, created_at, channel.is_partner, stream = packed
+
+        channel.created_at = _unpack_time(created_at)
+        channel.stream = Stream.unpack(stream) if stream is not None else None
+
+        return channel
@@ -0,0 +1,56 @@
+"""
+
+JSON encoding and decoding for everything that goes over the wire. orjson is
+used when it is installed, as it is several times quicker than the standard
+library, and `json` is used otherwise.
+
+"""
+
+import json
+from typing import Any, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# How a PubSub message starts when `type` is its first key, as Twitch sends it.
+TYPE_PREFIXES = ("{\"type\":\"", "{\"type\": \"")
+
+if orjson is not None:
+    name = "orjson"
+
+    def loads(data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+
+    def dumps(value: Any) -> str:
+        return orjson.dumps(value).decode("utf-8")
+
+    def dumps_bytes(value: Any) -> bytes:
+        return orjson.dumps(value)
+
+else:
+    name = "json"
+
+    def loads(data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+    def dumps(value: Any) -> str:
+        return json.dumps(value, separators=(",", ":"))
+
+    def dumps_bytes(value: Any) -> bytes:
+        return dumps(value).encode("utf-8")
+
+
+def peek_type(message: str) -> Optional[str]:
+    """
+    The `type` of an encoded message without decoding it, or None if the
+    type isn't the first key and the message has to be decoded to find it.
+    """
+    for prefix in TYPE_PREFIXES:
+        if message.startswith(prefix):
+            end = message.find("\"", len(prefix))
+
+            return message[len(prefix):end] if end != -1 else None
+
+    return None
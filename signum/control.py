@@ -0,0 +1,157 @@
+"""
+
+A small HTTP API on a local port for changing the fleet while it runs.
+Accounts and channels can be listed, added and removed, and each change only
+touches the PubSub topics, indexes and checks of what was changed.
+
+    GET    /accounts                 list the accounts
+    POST   /accounts                 {"cookie_file": "..."}
+    DELETE /accounts/{login}
+    GET    /channels                 list the channels
+    POST   /channels                 {"login": "...", "priority": 0}
+    DELETE /channels/{login}
+
+"""
+
+import logging
+from typing import Callable, Optional
+
+from aiohttp import web
+
+from .account import Account
+from .manager import Manager
+
+log = logging.getLogger(__name__)
+
+
+class ControlServer:
+    def __init__(
+        self,
+        manager: Manager,
+        create_account: Callable[[str], Account],
+        host: str = "127.0.0.1",
+        port: int = 8765
+    ):
+        self.manager = manager
+        self.create_account = create_account
+        self.host = host
+        self.port = port
+
+        self._runner: Optional[web.AppRunner] = None
+
+    @web.middleware
+    async def _require_started(self, request: web.Request, handler) -> web.StreamResponse:
+        if not self.manager.started.is_set():
+            return web.json_response({"error": "The manager is still starting"}, status=503)
+
+        return await handler(request)
+
+    async def _read_json(self, request: web.Request) -> dict:
+        try:
+            data = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text="The body must be JSON")
+
+        if not isinstance(data, dict):
+            raise web.HTTPBadRequest(text="The body must be a JSON object")
+
+        return data
+
+    async def _list_accounts(self, request: web.Request) -> web.Response:
+        return web.json_response([
+            {"login": account.username, "id": account.user_id}
+            for account in self.manager.accounts
+        ])
+
+    async def _add_account(self, request: web.Request) -> web.Response:
+        data = await self._read_json(request)
+
+        if not data.get("cookie_file"):
+            return web.json_response({"error": "cookie_file is required"}, status=400)
+
+        try:
+            account = self.create_account(data["cookie_file"])
+        except OSError as error:
+            return web.json_response({"error": f"Failed to read the cookie file: {error}"}, status=400)
+
+        try:
+            await self.manager.join_account(account)
+        except Exception as error:
+            log.warning(f"Failed to add account from {data['cookie_file']}: {error!r}")
+            return web.json_response({"error": str(error)}, status=400)
+
+        return web.json_response({"login": account.username, "id": account.user_id}, status=201)
+
+    async def _remove_account(self, request: web.Request) -> web.Response:
+        account = self.manager.find_account_by_login(request.match_info["login"])
+
+        if account is None:
+            return web.json_response({"error": "No such account"}, status=404)
+
+        await self.manager.leave_account(account)
+
+        return web.json_response({"login": account.username})
+
+    async def _list_channels(self, request: web.Request) -> web.Response:
+        return web.json_response([
+            {
+                "login": channel.name,
+                "id": channel.id,
+                "live": channel.is_streaming,
+                "priority": self.manager.channel_priority(channel)
+            }
+            for channel in self.manager.channels
+        ])
+
+    async def _add_channel(self, request: web.Request) -> web.Response:
+        data = await self._read_json(request)
+
+        if not data.get("login"):
+            return web.json_response({"error": "login is required"}, status=400)
+
+        try:
+            priority = int(data["priority"]) if data.get("priority") is not None else None
+        except (TypeError, ValueError):
+            return web.json_response({"error": "priority must be a number"}, status=400)
+
+        try:
+            channel = await self.manager.join_channel(data["login"], priority)
+        except Exception as error:
+            log.warning(f"Failed to add channel {data['login']}: {error!r}")
+            return web.json_response({"error": str(error)}, status=502)
+
+        if channel is None:
+            return web.json_response({"error": "Channel was not found on Twitch"}, status=404)
+
+        return web.json_response({"login": channel.name, "id": channel.id}, status=201)
+
+    async def _remove_channel(self, request: web.Request) -> web.Response:
+        channel = self.manager.find_channel_by_login(request.match_info["login"])
+
+        if channel is None:
+            return web.json_response({"error": "No such channel"}, status=404)
+
+        await self.manager.leave_channel(channel)
+
+        return web.json_response({"login": channel.name})
+
+    async def start(self) -> None:
+        app = web.Application(middlewares=[self._require_started])
+
+        app.router.add_get("/accounts", self._list_accounts)
+        app.router.add_post("/accounts", self._add_account)
+        app.router.add_delete("/accounts/{login}", self._remove_account)
+        app.router.add_get("/channels", self._list_channels)
+        app.router.add_post("/channels", self._add_channel)
+        app.router.add_delete("/channels/{login}", self._remove_channel)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+        log.info(f"Serving the control API on http://{self.host}:{self.port}")
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,227 @@
+"""
+
+Loads the accounts' cookie files. Files are read and parsed in a thread pool,
+and the results can be kept in a single credential store so that files that
+haven't changed since the last run are not parsed again. The store holds
+auth tokens, so it is only readable by its owner.
+
+"""
+
+import asyncio
+import json
+import logging
+import os
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import MozillaCookieJar
+from typing import Dict, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+STORE_VERSION = 2
+
+# The fields kept for each account in the credential store.
+RECORD_FIELDS = ("authorization_token", "user_id", "username", "unique_id")
+
+
+class Credentials:
+    __slots__ = ("path", "_cookies") + RECORD_FIELDS
+
+    def __init__(
+        self,
+        path: Optional[str],
+        authorization_token: Optional[str] = None,
+        user_id: Optional[int] = None,
+        username: Optional[str] = None,
+        unique_id: Optional[str] = None
+    ):
+        self.path = path
+
+        self.authorization_token = authorization_token
+        self.user_id = user_id
+        self.username = username
+        self.unique_id = unique_id
+
+        # Every cookie in the file, if it was read rather than stored.
+        self._cookies: Optional[Dict[str, str]] = None
+
+    @property
+    def cookies(self) -> Dict[str, str]:
+        """
+        The cookies to send, which are those in the file if it was read. The
+        store only keeps the ones Twitch reads from a signed in browser.
+        """
+        if self._cookies is not None:
+            return self._cookies
+
+        cookies = {
+            "auth-token": self.authorization_token,
+            "login": self.username,
+            "unique_id": self.unique_id
+        }
+
+        return {name: value for name, value in cookies.items() if value is not None}
+
+    @classmethod
+    def from_cookies(cls, path: Optional[str], cookies: Dict[str, str]) -> "Credentials":
+        credentials = cls(path, username=cookies.get("login"), unique_id=cookies.get("unique_id"))
+        credentials._cookies = cookies
+
+        if cookies.get("twilight-user"):
+            data: dict = json.loads(urllib.parse.unquote(cookies["twilight-user"]))
+
+            credentials.authorization_token = data.get("authToken")
+            credentials.user_id = int(data["id"]) if data.get("id") else None
+
+        return credentials
+
+    @classmethod
+    def from_file(cls, path: str) -> "Credentials":
+        """ Read a Netscape cookie file. """
+        cookie_jar = MozillaCookieJar()
+        cookie_jar.load(path)
+
+        return cls.from_cookies(path, {cookie.name: cookie.value for cookie in cookie_jar})
+
+    @classmethod
+    def from_record(cls, path: str, record: dict) -> "Credentials":
+        return cls(path, *[record.get(field) for field in RECORD_FIELDS])
+
+    def to_record(self) -> dict:
+        return {field: getattr(self, field) for field in RECORD_FIELDS}
+
+
+def _stat(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+
+    return stat.st_mtime_ns, stat.st_size
+
+
+class CredentialStore:
+    """
+    One record per cookie file, holding only the parsed fields, and kept
+    only while the file is unchanged.
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+
+        # Cookie file path to its (mtime, size) and parsed fields.
+        self._records: Dict[str, dict] = {}
+        self._changed = False
+
+    def load(self) -> None:
+        if not self.path or not os.path.isfile(self.path):
+            return
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as file_object:
+                data: dict = json.load(file_object)
+        except (OSError, ValueError) as error:
+            log.warning(f"Failed to read credential store {self.path}: {error}")
+            return
+
+        if data.get("version") == STORE_VERSION:
+            self._records = data.get("accounts", {})
+
+    def save(self) -> None:
+        if not self.path or not self._changed:
+            return
+
+        temporary_path = f"{self.path}.tmp"
+
+        try:
+            file_descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+
+            with open(file_descriptor, "w", encoding="utf-8") as file_object:
+                json.dump({"version": STORE_VERSION, "accounts": self._records}, file_object, separators=(",", ":"))
+
+            os.replace(temporary_path, self.path)
+            self._changed = False
+        except OSError as error:
+            log.warning(f"Failed to write credential store {self.path}: {error}")
+
+    def get(self, path: str, stat: Tuple[int, int]) -> Optional[Credentials]:
+        record = self._records.get(path)
+
+        if record is None or tuple(record["stat"]) != stat:
+            return None
+
+        return Credentials.from_record(path, record)
+
+    def put(self, credentials: Credentials, stat: Tuple[int, int]) -> None:
+        self._records[credentials.path] = {"stat": list(stat), **credentials.to_record()}
+        self._changed = True
+
+    def prune(self, paths: List[str]) -> None:
+        """ Forget files that are no longer being loaded. """
+        keep = set(paths)
+
+        for path in [path for path in self._records if path not in keep]:
+            del self._records[path]
+            self._changed = True
+
+
+def _load(path: str, store: CredentialStore) -> Credentials:
+    stat = _stat(path)
+    credentials = store.get(path, stat)
+
+    if credentials is None:
+        credentials = Credentials.from_file(path)
+        store.put(credentials, stat)
+
+    return credentials
+
+
+def _load_chunk(paths: List[str], store: CredentialStore) -> list:
+    """ Load several files in one go, returning exceptions for failures. """
+    results = []
+
+    for path in paths:
+        try:
+            results.append(_load(path, store))
+        except Exception as error:
+            results.append(error)
+
+    return results
+
+
+async def load_credentials(
+    paths: List[str],
+    store_path: Optional[str] = None,
+    threads: int = 8
+) -> List[Credentials]:
+    """
+    Load every cookie file in a thread pool, skipping any that fail. With
+    `store_path`, files that haven't changed since they were stored are
+    taken from the store instead of being parsed.
+    """
+    loop = asyncio.get_running_loop()
+    store = CredentialStore(store_path)
+
+    with ThreadPoolExecutor(max(1, threads), thread_name_prefix="signum-credentials") as executor:
+        await loop.run_in_executor(executor, store.load)
+
+        # A chunk per thread, rather than a task per file, keeps the
+        # overhead of handing work over to the pool down.
+        size = max(1, -(-len(paths) // max(1, threads)))
+        chunks = await asyncio.gather(*[
+            loop.run_in_executor(executor, _load_chunk, paths[index:index + size], store)
+            for index in range(0, len(paths), size)
+        ])
+
+        results = [result for chunk in chunks for result in chunk]
+
+        store.prune(paths)
+        await loop.run_in_executor(executor, store.save)
+
+    credentials = []
+
+    for path, result in zip(paths, results):
+        if isinstance(result, Exception):
+            log.error(f"Failed to load cookie file {path}: {result!r}")
+        else:
+            credentials.append(result)
+
+    log.info(f"Loaded {len(credentials)}/{len(paths)} cookie file(s)")
+
+    return credentials
@@ -0,0 +1,127 @@
+"""
+
+Queues PubSub messages between the websocket readers and the manager, so a
+slow handler never holds up reading from a socket. Messages are spread over
+a number of worker queues by channel, which keeps the messages of a single
+channel in order while different channels are handled in parallel.
+
+"""
+
+import asyncio
+import logging
+import re
+from typing import Awaitable, Callable, List, Optional
+
+log = logging.getLogger(__name__)
+
+CHANNEL_ID_PATTERN = re.compile(r"\"channel_id\":\s*\"?(\d+)")
+
+# Message types that are waited on rather than dropped when a queue is full.
+PRIORITY_TYPES = ("claim-available", "raid_go_v2")
+
+
+class EventDispatcher:
+    def __init__(
+        self,
+        handler: Callable[[dict], Awaitable[None]],
+        workers: int = 4,
+        queue_size: int = 1000
+    ):
+        self._handler = handler
+
+        self._queues: List[asyncio.Queue] = [
+            asyncio.Queue(queue_size) for _ in range(max(1, workers))
+        ]
+        self._tasks: List[asyncio.Task] = []
+
+        self.received = 0
+        self.ignored = 0
+        self.dropped = 0
+        self.processed = 0
+        self.failed = 0
+        self.high_water = 0
+
+    @property
+    def depth(self) -> int:
+        """ Number of messages waiting across every worker queue. """
+        return sum(queue.qsize() for queue in self._queues)
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "high_water": self.high_water,
+            "received": self.received,
+            "ignored": self.ignored,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "failed": self.failed
+        }
+
+    def start(self) -> None:
+        loop = asyncio.get_event_loop()
+
+        for queue in self._queues:
+            self._tasks.append(loop.create_task(self._work(queue)))
+
+    async def join(self) -> None:
+        """ Wait until every queued message has been handled. """
+        await asyncio.gather(*[queue.join() for queue in self._queues])
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def _partition(self, topic: str, message: str) -> asyncio.Queue:
+        """ Pick the queue for a message, keyed by its channel if it has one. """
+        search = CHANNEL_ID_PATTERN.search(message)
+        key: Optional[int] = int(search.group(1)) if search else hash(topic)
+
+        return self._queues[key % len(self._queues)]
+
+    async def put(self, event: dict) -> None:
+        """
+        Queue a message for the workers. PONGs and other messages without a
+        topic are never queued, other messages are dropped if their queue is
+        full, and claims and raids wait until there is space.
+        """
+        self.received += 1
+
+        data: dict = event.get("data") or {}
+        topic, message = data.get("topic"), data.get("message")
+
+        if not topic or not message:
+            self.ignored += 1
+            return
+
+        queue = self._partition(topic, message)
+
+        if any(message_type in message for message_type in PRIORITY_TYPES):
+            await queue.put(event)
+        else:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+                if self.dropped % 100 == 1:
+                    log.warning(f"Event queue is full, {self.dropped} message(s) dropped so far")
+
+                return
+
+        self.high_water = max(self.high_water, self.depth)
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        while True:
+            event = await queue.get()
+
+            try:
+                await self._handler(event)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                log.exception("Failed to handle PubSub message")
+            finally:
+                queue.task_done()
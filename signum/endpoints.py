@@ -0,0 +1,37 @@
+"""
+
+The Twitch URLs used by the accounts and PubSub connections. They can all be
+pointed at a stand-in server, such as the one in `benchmarks/fake_twitch.py`,
+to test without touching Twitch.
+
+"""
+
+
+class Endpoints:
+    def __init__(
+        self,
+        home: str = "https://www.twitch.tv/",
+        gql: str = "https://gql.twitch.tv/gql",
+        settings: str = "https://static.twitchcdn.net/config/settings.js",
+        pubsub: str = "wss://pubsub-edge.twitch.tv/v1"
+    ):
+        self.home = home
+        self.gql = gql
+        self.settings = settings
+        self.pubsub = pubsub
+
+    @classmethod
+    def from_base_url(cls, base_url: str) -> "Endpoints":
+        """ Endpoints for a stand-in server serving everything from one host. """
+        base_url = base_url.rstrip("/")
+        websocket_url = "ws" + base_url[len("http"):] if base_url.startswith("http") else base_url
+
+        return cls(
+            home=f"{base_url}/",
+            gql=f"{base_url}/gql",
+            settings=f"{base_url}/config/settings.js",
+            pubsub=f"{websocket_url}/pubsub"
+        )
+
+
+default_endpoints = Endpoints()
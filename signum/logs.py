@@ -0,0 +1,148 @@
+"""
+
+Logging setup. By default records are handed to a background thread through
+a queue, so formatting them and writing them to the console and the rotating
+debug log happens off the event loop. Debug messages from the busiest
+loggers can also be sampled, keeping one in every so many.
+
+"""
+
+import itertools
+import logging
+import logging.handlers
+import queue
+import sys
+from typing import Dict, List, Optional, Tuple
+
+# Loggers that write a debug message for every PubSub message.
+SAMPLED_LOGGERS = ("signum.websocket.pubsub", "signum.dispatcher")
+
+
+class StreamFormatter(logging.Formatter):
+    base_format: List[str] = [
+        "[%(asctime)s]",
+        "%(message)s"
+    ]
+
+    extra_format: List[Tuple[str, str, int]] = [
+        ("channel", "[%(channel)s]", 1),
+        ("account", "[%(account)s]", 1)
+    ]
+
+    def __init__(self, datefmt: Optional[str] = None):
+        super().__init__(" ".join(self.base_format), datefmt)
+
+        # One formatter for each combination of extra attributes a record
+        # can have, built up front rather than for every record.
+        self._formatters: Dict[Tuple[bool, ...], logging.Formatter] = {}
+
+        for present in itertools.product((False, True), repeat=len(self.extra_format)):
+            _base_format = self.base_format.copy()
+
+            for (attr, form, index), has_attr in zip(self.extra_format, present):
+                if has_attr:
+                    _base_format.insert(index, form)
+
+            self._formatters[present] = logging.Formatter(" ".join(_base_format), datefmt)
+
+    def format(self, record):
+        present = tuple(hasattr(record, attr) for attr, _, _ in self.extra_format)
+
+        return self._formatters[present].format(record)
+
+
+class DebugSampler(logging.Filter):
+    """ Lets through every record above DEBUG, and one in `rate` at DEBUG. """
+    def __init__(self, rate: int):
+        super().__init__()
+
+        self.rate = max(1, rate)
+        self._count = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+
+        self._count += 1
+
+        return (self._count - 1) % self.rate == 0
+
+
+class _ThreadQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records over as they are. The standard handler formats each record
+    before queueing it so it can be pickled, which isn't needed within one
+    process and would keep the formatting on the event loop.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def install_sampler(rate: int) -> None:
+    """ Keep one in `rate` debug messages from the busiest loggers. """
+    if rate <= 1:
+        return
+
+    for name in SAMPLED_LOGGERS:
+        logging.getLogger(name).addFilter(DebugSampler(rate))
+
+
+def configure_logging(
+    log_file: str = "debug.log",
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5,
+    sample_rate: int = 1,
+    use_queue: bool = True
+) -> Optional[logging.handlers.QueueListener]:
+    """
+    Log INFO and above to the console and everything to a rotating file. If
+    `use_queue` is set, returns the started listener that does the writing,
+    which should be stopped on exit to flush it.
+    """
+    log = logging.getLogger()
+    log.setLevel(logging.DEBUG)
+
+    stream_formatter = StreamFormatter(datefmt="%Y-%m-%d %H:%M:%S")
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(stream_formatter)
+    stream_handler.setLevel(logging.INFO)
+
+    file_formatter = logging.Formatter(
+        "%(created)i/%(name)s/%(levelname)s/%(account)s:%(channel)s/%(message)s",
+        defaults={
+            "account": "",
+            "channel": ""
+        }
+    )
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file,
+        maxBytes=max_bytes,
+        backupCount=backup_count,
+        encoding="utf-8"
+    )
+    file_handler.setFormatter(file_formatter)
+    file_handler.setLevel(logging.DEBUG)
+
+    logging.getLogger("charset_normalizer").setLevel(logging.ERROR)
+    install_sampler(sample_rate)
+
+    if not use_queue:
+        log.addHandler(stream_handler)
+        log.addHandler(file_handler)
+
+        return None
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        records,
+        stream_handler,
+        file_handler,
+        respect_handler_level=True
+    )
+
+    log.addHandler(_ThreadQueueHandler(records))
+    listener.start()
+
+    return listener
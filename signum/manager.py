@@ -7,142 +7,1101 @@ appending `signum.Event` objects to the queue in the manager.
 """
 
 import asyncio
-import json
+import functools
 import logging
-from typing import List, Optional
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
+import aiohttp
+
+from . import codec
 from .account import Account
+from .cache import config_cache
 from .channel import Channel
+from .dispatcher import EventDispatcher
+from .endpoints import Endpoints, default_endpoints
+from .metrics import CLAIM_SECONDS, EVENT_SECONDS, MetricsExporter, registry
+from .planner import ChannelPlanner
+from .poller import StatusPoller
+from .ratelimit import ConcurrencyLimiter, RateLimiter
+from .recorder import TrafficRecorder
+from .scheduler import Job, WatchScheduler
+from .snapshot import Snapshot
+from .websocket.pubsub import PubsubPool
 
 log = logging.getLogger(__name__)
 
+EventHandler = Callable[[Account, dict], Awaitable[None]]
+ChannelEventHandler = Callable[[Channel, dict], Awaitable[None]]
+
+RAID_TOPIC = "raid"
+
 
 class Manager:
-    def __init__(self, channel_names: List[str]):
+    def __init__(
+        self,
+        channel_names: List[str],
+        connection_limit: int = 100,
+        connection_limit_per_host: int = 50,
+        keepalive_timeout: float = 30.0,
+        dns_cache_ttl: int = 300,
+        startup_concurrency: int = 20,
+        event_workers: int = 4,
+        event_queue_size: int = 1000,
+        watch_interval: float = 60.0,
+        max_in_flight: int = 50,
+        max_channels: int = 2,
+        channel_priorities: Optional[Dict[str, int]] = None,
+        endpoints: Optional[Endpoints] = None,
+        metrics_port: Optional[int] = None,
+        metrics_file: Optional[str] = None,
+        metrics_interval: float = 60.0,
+        snapshot_file: Optional[str] = None,
+        snapshot_interval: float = 5 * 60,
+        snapshot_max_age: float = 10 * 60,
+        host_rate: float = 50,
+        account_rate: float = 5,
+        initial_concurrency: float = 10,
+        max_concurrency: float = 50,
+        latency_target: float = 1.0,
+        poll_interval: float = 60.0,
+        max_poll_interval: float = 600.0,
+        poll_batch_size: int = 25,
+        record_file: Optional[str] = None
+    ):
         self.accounts: List[Account] = []
         self.channels: List[Channel] = []
 
         self._channel_names: List[str] = channel_names
+
+        # Set once the accounts and channels are ready and watching begins.
+        self.started = asyncio.Event()
+        self._endpoints = endpoints or default_endpoints
+
+        self._accounts_by_id: Dict[int, Account] = {}
+        self._accounts_by_login: Dict[str, Account] = {}
+        self._channels_by_id: Dict[int, Channel] = {}
+        self._channels_by_login: Dict[str, Channel] = {}
+
+        self._handlers: Dict[Tuple[str, str], EventHandler] = {}
+        self._channel_handlers: Dict[Tuple[str, str], ChannelEventHandler] = {}
+        self._handled_topics: Set[str] = set()
+
+        self.register_handler("stream-change-v1", "stream_up", self._on_stream_up)
+        self.register_handler("stream-change-v1", "stream_down", self._on_stream_down)
+        self.register_handler("community-points-user-v1", "points-earned", self._on_points_earned)
+        self.register_handler("community-points-user-v1", "claim-available", self._on_claim_available)
+
+        self.register_channel_handler(RAID_TOPIC, "raid_update_v2", self._on_raid_update)
+        self.register_channel_handler(RAID_TOPIC, "raid_go_v2", self._on_raid_go)
+        self.register_channel_handler(RAID_TOPIC, "raid_cancel_v2", self._on_raid_cancel)
+
+        self._connection_limit = connection_limit
+        self._connection_limit_per_host = connection_limit_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._dns_cache_ttl = dns_cache_ttl
+
+        self._startup_concurrency = max(1, startup_concurrency)
+
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self._pubsub: Optional[PubsubPool] = None
+
+        # Requests per second to each host, and by each account to a host.
+        self._rate_limiter = RateLimiter(
+            host_rate=host_rate,
+            host_burst=host_rate * 2,
+            account_rate=account_rate,
+            account_burst=account_rate * 4
+        )
+
+        # Requests in flight to each host, adjusted to how Twitch responds.
+        self._concurrency_limiter = ConcurrencyLimiter(
+            initial=initial_concurrency,
+            maximum=max_concurrency,
+            latency_target=latency_target
+        )
+
+        self._dispatcher = EventDispatcher(
+            self._update_event,
+            workers=event_workers,
+            queue_size=event_queue_size
+        )
+
+        self._scheduler = WatchScheduler(
+            period=watch_interval,
+            max_in_flight=max_in_flight
+        )
+
+        self._metrics = MetricsExporter(
+            port=metrics_port,
+            path=metrics_file,
+            interval=metrics_interval
+        )
+
+        # Looks channels up in case PubSub misses a stream changing.
+        self._poller = StatusPoller(poll_interval, max_poll_interval) if poll_interval > 0 else None
+        self._poll_batch_size = max(1, poll_batch_size)
+
+        self._snapshot_file = snapshot_file
+        self._snapshot_interval = snapshot_interval
+        self._snapshot_max_age = snapshot_max_age
+
+        # Every PubSub frame received is written here, to be replayed later.
+        self._record_file = record_file
+        self._recorder: Optional[TrafficRecorder] = None
+
+        # Targets of announced raids being looked up, by the raiding channel's
+        # ID, and channels only tracked because of a raid, mapped to the
+        # channel that raided them.
+        self._raids: Dict[int, Tuple[str, asyncio.Task]] = {}
+        self._raid_targets: Dict[int, int] = {}
+
+        # The account whose token the raid topics are listened to with.
+        self._raid_account: Optional[Account] = None
+
+        # Pairs of (user ID, channel ID) known to be following.
+        self._following: Set[Tuple[int, int]] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+        self._planner = ChannelPlanner(max_channels)
+        self._channel_priorities: Dict[str, int] = {
+            name.lower(): priority
+            for name, priority in (channel_priorities or {}).items()
+        }
+
+    def _create_connector(self) -> aiohttp.TCPConnector:
+        """
+        Create the connection pool shared by every account. Connections to
+        the GQL and Spade hosts are kept alive between ticks rather than
+        being opened again for every request.
+        """
+        return aiohttp.TCPConnector(
+            limit=self._connection_limit,
+            limit_per_host=self._connection_limit_per_host,
+            keepalive_timeout=self._keepalive_timeout,
+            ttl_dns_cache=self._dns_cache_ttl
+        )
+
+    async def close(self) -> None:
+        """ Close the PubSub connections, every session, then the connector. """
+        for task in self._tasks:
+            task.cancel()
+
+        if self._snapshot_file and self.channels:
+            self._save_snapshot()
+
+        await self._metrics.close()
+
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+
+        await self._dispatcher.close()
+
+        await asyncio.gather(
+            *[account.close() for account in self.accounts],
+            return_exceptions=True
+        )
+
+        if self._connector is not None:
+            await self._connector.close()
+            self._connector = None
     
+    def add_account(self, account: Account) -> None:
+        """
+        Add an account, indexing it once its user ID is known. A second copy
+        of an account is left out of the index, so that it fails to
+        initialize rather than taking the original's place.
+        """
+        self.accounts.append(account)
+        account.set_rate_limiter(self._rate_limiter)
+        account.set_concurrency_limiter(self._concurrency_limiter)
+
+        if account.user_id is not None and not self._is_duplicate(account):
+            self._accounts_by_id[int(account.user_id)] = account
+
+    def _is_duplicate(self, account: Account) -> bool:
+        """ Whether another account with the same user ID is being farmed. """
+        if account.user_id is None:
+            return False
+
+        return self._accounts_by_id.get(int(account.user_id), account) is not account
+
+    def remove_account(self, account: Account) -> None:
+        if account in self.accounts:
+            self.accounts.remove(account)
+
+        # A duplicate of a running account must leave the original indexed.
+        if account.user_id is not None and self._accounts_by_id.get(int(account.user_id)) is account:
+            self._accounts_by_id.pop(int(account.user_id))
+            self._planner.remove_account(int(account.user_id))
+
+        if account.username is not None and self._accounts_by_login.get(account.username.lower()) is account:
+            self._accounts_by_login.pop(account.username.lower())
+
+    def add_channel(self, channel: Channel) -> None:
+        self.channels.append(channel)
+
+        self._channels_by_id[channel.id] = channel
+        self._channels_by_login[channel.name.lower()] = channel
+
+        self._planner.add_channel(
+            channel.id,
+            self._channel_priorities.get(channel.name.lower(), 0),
+            live=channel.is_streaming
+        )
+
+    def remove_channel(self, channel: Channel) -> None:
+        if channel in self.channels:
+            self.channels.remove(channel)
+
+        self._channels_by_id.pop(channel.id, None)
+        self._channels_by_login.pop(channel.name.lower(), None)
+
+        self._planner.remove_channel(channel.id)
+
+    def apply_channel_data(self, channel_data: dict) -> Channel:
+        """ Add a channel, or bring a known one up to date, from GQL data. """
+        channel = self._find_channel_by_login(channel_data["login"])
+
+        if channel is None:
+            channel = Channel(channel_data)
+            self.add_channel(channel)
+
+            return channel
+
+        self._channel_changed(channel, channel.update(channel_data))
+
+        return channel
+
+    def apply_channel(self, incoming: Channel) -> Channel:
+        """ Add a channel, or bring a known one up to date, from another copy of it. """
+        channel = self._find_channel_by_login(incoming.name)
+
+        if channel is None:
+            self.add_channel(incoming)
+
+            return incoming
+
+        self._channel_changed(channel, channel.merge(incoming))
+
+        return channel
+
+    def _channel_changed(self, channel: Channel, changed: Set[str]) -> None:
+        if not changed:
+            return
+
+        log.debug(f"Channel changed: {', '.join(sorted(changed))}", extra={
+            "channel": channel.name
+        })
+
+        if "stream" in changed:
+            self._planner.set_live(channel.id, channel.is_streaming)
+
+            if channel.id in self._raid_targets and not channel.is_streaming:
+                self._drop_raid_target(channel.id)
+
+    def find_account_by_login(self, login: str) -> Optional[Account]:
+        return self._accounts_by_login.get(login.lower())
+
+    def find_channel_by_login(self, login: str) -> Optional[Channel]:
+        return self._find_channel_by_login(login)
+
+    def channel_priority(self, channel: Channel) -> int:
+        return self._channel_priorities.get(channel.name.lower(), 0)
+
+    async def join_account(self, account: Account) -> None:
+        """
+        Start farming with an account while running. Only the account's own
+        topics are listened to and only its own follows and claims checked.
+        """
+        if self._is_duplicate(account):
+            await account.close()
+            raise Exception("The account is already being farmed")
+
+        self.add_account(account)
+        account.set_connector(self._connector)
+
+        try:
+            await self._initialize_account(account)
+        except Exception:
+            await self._discard_account(account)
+            raise
+
+        self._planner.add_account(account.user_id)
+        self._start_task(self._prepare_account(account))
+
+        log.info("Joined the running manager", extra={"account": account.username})
+
+    async def leave_account(self, account: Account) -> None:
+        """ Stop farming with an account, unlistening only its own topics. """
+        self.remove_account(account)
+
+        # Nothing more is sent for the account, and its session is left closed.
+        await self._scheduler.cancel(account.user_id)
+
+        if self._pubsub is not None:
+            await self._pubsub.unlisten(account.topics)
+
+            if self._raid_account is account:
+                await self._move_raid_topics()
+
+        await account.close()
+
+        log.info("Left the running manager", extra={"account": account.username})
+
+    async def join_channel(self, channel_name: str, priority: Optional[int] = None) -> Optional[Channel]:
+        """
+        Start tracking a channel while running, following it and claiming its
+        points on every account. Returns None if Twitch doesn't know it.
+        """
+        if priority is not None:
+            self._channel_priorities[channel_name.lower()] = priority
+
+        channel = self._find_channel_by_login(channel_name)
+
+        if channel is not None:
+            self._planner.add_channel(channel.id, self.channel_priority(channel), live=channel.is_streaming)
+
+            # Asked for by name, so a raid's target is kept from now on.
+            if self._raid_targets.pop(channel.id, None) is not None:
+                self._channel_names.append(channel.name)
+                await self._listen_raids()
+
+            return channel
+
+        channel_data = await self.accounts[0].fetch_channel(channel_name)
+
+        if not channel_data:
+            return None
+
+        channel = self.apply_channel_data(channel_data)
+        self._channel_names.append(channel.name)
+
+        accounts = list(self.accounts)
+        results = await self._run_bounded(
+            self._prepare_channel(account, channel) for account in accounts
+        )
+
+        for account, result in zip(accounts, results):
+            if isinstance(result, Exception):
+                log.error(f"Failed to prepare channel: {result!r}", extra={
+                    "channel": channel.name,
+                    "account": account.username
+                })
+
+        await self._listen_raids()
+
+        log.info("Started tracking the channel", extra={"channel": channel.display_name})
+
+        return channel
+
+    async def leave_channel(self, channel: Channel) -> None:
+        """ Stop tracking a channel, moving its watchers to other channels. """
+        self.remove_channel(channel)
+        self._raid_targets.pop(channel.id, None)
+
+        if self._pubsub is not None:
+            await self._pubsub.unlisten([f"{RAID_TOPIC}.{channel.id}"])
+
+        self._channel_names = [
+            channel_name for channel_name in self._channel_names
+            if channel_name.lower() != channel.name.lower()
+        ]
+
+        log.info("Stopped tracking the channel", extra={"channel": channel.display_name})
+
     def _find_account_by_id(self, user_id: int) -> Optional[Account]:
         """ Find an account in the local storage from its ID. """
-        for account in self.accounts:
-            if account.user_id == int(user_id):
-                return account
+        return self._accounts_by_id.get(int(user_id))
     
     def _find_channel_by_id(self, channel_id: int) -> Optional[Channel]:
         """ Find a channel in the local storage from its ID. """
-        for channel in self.channels:
-            if channel.id == int(channel_id):
-                return channel
-    
-    async def _update_event(self, event: dict) -> None:
+        return self._channels_by_id.get(int(channel_id))
+
+    def _find_channel_by_login(self, login: str) -> Optional[Channel]:
+        """ Find a channel in the local storage from its login name. """
+        return self._channels_by_login.get(login.lower())
+
+    def register_handler(self, topic: str, message_type: str, handler: EventHandler) -> None:
         """
-        Update a channel's status based on data from the client's websockets.
+        Call `handler` with the account and decoded message whenever a message
+        of the given type arrives on the given topic.
+        """
+        self._handlers[(topic, message_type)] = handler
+        self._handled_topics.add(topic)
+
+    def register_channel_handler(self, topic: str, message_type: str, handler: ChannelEventHandler) -> None:
+        """
+        Like `register_handler`, for topics that end in a channel's ID rather
+        than an account's. `handler` is called with the channel instead.
         """
+        self._channel_handlers[(topic, message_type)] = handler
+        self._handled_topics.add(topic)
 
+    def _decode_event(self, event: dict) -> Optional[Tuple[str, str, dict]]:
+        """
+        Split a PubSub message into its topic, the ID the topic ends in, and
+        the decoded message inside it. Returns None, without decoding the
+        inner message, if nothing handles its topic and type.
+        """
         data: dict = event.get("data", {})
 
         # Most likely PONG message, doesn't have any useful data so we skip.
         if not data.get("topic") or not data.get("message"):
-            return
+            return None
 
-        topic, user_id = data["topic"].rsplit(".", 1)
-        message = json.loads(data["message"])
-        
-        # Find user by the given ID.
-        user = self._find_account_by_id(user_id)
+        topic, target_id = data["topic"].rsplit(".", 1)
+
+        if topic not in self._handled_topics:
+            return None
+
+        message_type = codec.peek_type(data["message"])
+
+        if message_type is not None and (topic, message_type) not in self._handlers \
+                and (topic, message_type) not in self._channel_handlers:
+            return None
+
+        return topic, target_id, codec.loads(data["message"])
+    
+    async def _update_event(self, event: dict) -> None:
+        """
+        Update a channel's status based on data from the client's websockets.
+        """
+        decoded = self._decode_event(event)
 
-        if not user:
-            log.warning(f"Failed to find user {user_id} from event callback")
+        if decoded is None:
             return
 
-        # TODO: Fix this up soon, define callbacks rather than a big ol' if/elif.
-        if topic == "stream-change-v1":
-            channel = self._find_channel_by_id(message["channel_id"])
+        topic, target_id, message = decoded
+
+        message_type = message.get("type")
+        channel_handler = self._channel_handlers.get((topic, message_type))
+
+        if channel_handler is not None:
+            channel = self._find_channel_by_id(target_id)
 
             if not channel:
                 return
 
-            if message["type"] == "stream_up" and not channel.is_streaming:
-                channel.update(await self.accounts[0].fetch_channel(channel.name))
-                log.info(f"Started streaming {channel.stream.game_name}", extra={
-                    "channel": channel.display_name
+            await channel_handler(channel, message)
+
+        else:
+            handler = self._handlers.get((topic, message_type))
+
+            if handler is None:
+                return
+
+            # Find user by the given ID.
+            user = self._find_account_by_id(target_id)
+
+            if not user:
+                log.warning(f"Failed to find user {target_id} from event callback")
+                return
+
+            await handler(user, message)
+
+        if event.get("received_at") is not None:
+            elapsed = time.monotonic() - event["received_at"]
+            EVENT_SECONDS.observe(elapsed, topic, message_type)
+
+            if message_type == "claim-available":
+                CLAIM_SECONDS.observe(elapsed)
+
+    async def _on_stream_up(self, account: Account, message: dict) -> None:
+        channel = self._find_channel_by_id(message["channel_id"])
+
+        if not channel or channel.is_streaming:
+            return
+
+        channel.update(await self.accounts[0].fetch_channel(channel.name))
+
+        # Twitch can announce a stream before GQL has caught up with it.
+        if not channel.is_streaming:
+            return
+
+        log.info(f"Started streaming {channel.stream.game_name}", extra={
+            "channel": channel.display_name
+        })
+
+        self._planner.set_live(channel.id, channel.is_streaming)
+
+        # Back from a raid, so the channel it raided is no longer needed.
+        for target_id, source_id in list(self._raid_targets.items()):
+            if source_id == channel.id:
+                self._drop_raid_target(target_id)
+
+    async def _on_stream_down(self, account: Account, message: dict) -> None:
+        channel = self._find_channel_by_id(message["channel_id"])
+
+        if not channel or not channel.is_streaming:
+            return
+
+        channel.stream = None
+        log.info(f"Stopped streaming", extra={
+            "channel": channel.display_name
+        })
+
+        self._planner.set_live(channel.id, False)
+
+        if channel.id in self._raid_targets:
+            self._drop_raid_target(channel.id)
+
+    async def _on_points_earned(self, account: Account, message: dict) -> None:
+        channel = self._find_channel_by_id(message["data"]["balance"]["channel_id"])
+
+        if not channel:
+            return
+
+        self._planner.update_balance(account.user_id, channel.id, message["data"]["balance"]["balance"])
+
+        if message["data"]["point_gain"].get("reason_code") == "WATCH_STREAK":
+            self._planner.mark_streak(account.user_id, channel.id)
+
+        log.info(
+            f"Gained {message['data']['point_gain']['total_points']} points "
+            f"({message['data']['balance']['balance']} total)",
+            extra={
+                "channel": channel.name,
+                "account": account.username
+            }
+        )
+
+    async def _on_claim_available(self, account: Account, message: dict) -> None:
+        claim = message["data"]["claim"]
+        channel = self._find_channel_by_id(claim["channel_id"])
+
+        if not channel:
+            return
+
+        await account.claim_points(channel, claim["id"])
+    
+    async def _resolve_raid_target(self, target_login: str) -> Optional[Channel]:
+        channel = self._find_channel_by_login(target_login)
+
+        if channel is not None:
+            return channel
+
+        channel_data = await self.accounts[0].fetch_channel(target_login)
+
+        return Channel(channel_data) if channel_data else None
+
+    async def _on_raid_update(self, channel: Channel, message: dict) -> None:
+        """
+        A raid has been announced. The target is looked up straight away, in
+        the background, so it's ready by the time the raid goes through.
+        """
+        raid = message["raid"]
+        target_login = raid["target_login"].lower()
+
+        # Updates keep coming with the viewer count until the raid goes.
+        if channel.id in self._raids and self._raids[channel.id][0] == target_login:
+            return
+
+        log.info(f"Raiding {raid['target_display_name']}", extra={
+            "channel": channel.display_name
+        })
+
+        self._raids[channel.id] = (target_login, self._start_task(self._resolve_raid_target(target_login)))
+
+    async def _on_raid_cancel(self, channel: Channel, message: dict) -> None:
+        _, task = self._raids.pop(channel.id, (None, None))
+
+        if task is not None:
+            task.cancel()
+
+    async def _on_raid_go(self, channel: Channel, message: dict) -> None:
+        target_login = message["raid"]["target_login"].lower()
+        pending_login, task = self._raids.pop(channel.id, (None, None))
+
+        if task is None or pending_login != target_login:
+            task = self._start_task(self._resolve_raid_target(target_login))
+
+        self._start_task(self._follow_raid(channel, task))
+
+    async def _follow_raid(self, source: Channel, task: asyncio.Task) -> None:
+        """
+        Move the raiding channel's watchers over to the raid's target. A target
+        that isn't tracked already is tracked until it or the raiding channel
+        changes again, at the raiding channel's priority.
+        """
+        try:
+            target = await task
+        except Exception as error:
+            log.warning(f"Failed to find the raid's target: {error!r}", extra={
+                "channel": source.display_name
+            })
+            return
+
+        if target is None or not target.is_streaming:
+            return
+
+        if self._find_channel_by_id(target.id) is None:
+            self._channel_priorities.setdefault(target.name.lower(), self.channel_priority(source))
+            self._raid_targets[target.id] = source.id
+            self.add_channel(target)
+
+        # The raid ends the stream, and the planner moves its watchers on.
+        source.stream = None
+        moved = self._planner.set_live(source.id, False)
+
+        log.info(f"Followed the raid to {target.display_name} with {moved} account(s)", extra={
+            "channel": source.display_name
+        })
+
+    def _drop_raid_target(self, channel_id: int) -> None:
+        self._raid_targets.pop(channel_id, None)
+        channel = self._find_channel_by_id(channel_id)
+
+        if channel is None:
+            return
+
+        self._channel_priorities.pop(channel.name.lower(), None)
+        self.remove_channel(channel)
+
+        log.info("Stopped tracking the raided channel", extra={"channel": channel.display_name})
+
+    def _raid_topics(self) -> List[str]:
+        return [
+            f"{RAID_TOPIC}.{channel.id}" for channel in self.channels
+            if channel.id not in self._raid_targets
+        ]
+
+    async def _listen_raids(self) -> None:
+        """ Listen for raids from every tracked channel not already listened to. """
+        if self._raid_account is None:
+            if not self.accounts:
+                return
+
+            self._raid_account = self.accounts[0]
+
+        try:
+            await self._pubsub.listen(self._raid_topics(), self._raid_account.authorization_token, self._dispatcher.put)
+        except Exception as error:
+            log.warning(f"Failed to listen for raids: {error!r}")
+
+    async def _move_raid_topics(self) -> None:
+        """
+        Listen for raids again with another account's token, once the account
+        they were listened to with has left. Otherwise they would be listened
+        to again with the old token whenever the connection reopens.
+        """
+        self._raid_account = None
+
+        await self._pubsub.unlisten(self._raid_topics())
+        await self._listen_raids()
+
+    def _register_gauges(self) -> None:
+        registry.gauge("signum_accounts", "Accounts being farmed", lambda: len(self.accounts))
+        registry.gauge("signum_channels_live", "Tracked channels that are live", lambda: sum(
+            1 for channel in self.channels if channel.is_streaming
+        ))
+        registry.gauge("signum_event_queue_depth", "PubSub messages waiting to be handled", lambda: self._dispatcher.depth)
+        registry.gauge("signum_event_queue_dropped", "PubSub messages dropped because the queue was full", lambda: self._dispatcher.dropped)
+        registry.gauge("signum_pubsub_connections", "Open PubSub connections", lambda: self._pubsub.connection_count if self._pubsub else 0)
+        registry.gauge("signum_watch_ticks_late", "Watch ticks that started late", lambda: self._scheduler.late_ticks)
+        registry.gauge("signum_watch_ticks_missed", "Watch ticks that were missed", lambda: self._scheduler.missed_ticks)
+        registry.gauge("signum_channel_poll_corrections", "Streams found up or down by polling rather than PubSub", lambda: self._poller.corrections if self._poller else 0)
+        registry.gauge("signum_rate_limited_requests", "Requests waiting on a host's rate limit", lambda: sum(
+            self._rate_limiter.depths().values()
+        ))
+        registry.gauge("signum_concurrency_limit", "Requests allowed in flight to each host", lambda: {
+            (host,): round(limit, 2) for host, limit in self._concurrency_limiter.limits().items()
+        }, ("host",))
+        registry.gauge("signum_requests_in_flight", "Requests in flight to each host", lambda: {
+            (host,): count for host, count in self._concurrency_limiter.in_flight().items()
+        }, ("host",))
+        registry.gauge("signum_concurrency_limited_requests", "Requests waiting for a slot on each host", lambda: {
+            (host,): depth for host, depth in self._concurrency_limiter.depths().items()
+        }, ("host",))
+
+    async def _run_bounded(self, coroutines: Iterable[Awaitable]) -> list:
+        """
+        Run the coroutines concurrently, at most `startup_concurrency` at a
+        time. Exceptions are returned in place of results rather than raised.
+        """
+        semaphore = asyncio.Semaphore(self._startup_concurrency)
+
+        async def bounded(coroutine: Awaitable):
+            async with semaphore:
+                return await coroutine
+
+        return await asyncio.gather(
+            *[bounded(coroutine) for coroutine in coroutines],
+            return_exceptions=True
+        )
+
+    async def _initialize_account(self, account: Account) -> None:
+        await account.initialize_user()
+
+        if self._is_duplicate(account):
+            raise Exception("The account is already being farmed")
+
+        self._accounts_by_id[int(account.user_id)] = account
+
+        if account.username is not None:
+            self._accounts_by_login[account.username.lower()] = account
+
+        await account.initialize_websocket(self._pubsub, self._dispatcher.put)
+
+    async def _discard_account(self, account: Account) -> None:
+        """
+        Drop an account that failed to initialize, along with any topics it
+        got as far as listening to. A duplicate's topics belong to the
+        original, so they are left alone.
+        """
+        duplicate = self._is_duplicate(account)
+        self.remove_account(account)
+
+        if not duplicate and account.user_id is not None and self._pubsub is not None:
+            await self._pubsub.unlisten(account.topics)
+
+        await account.close()
+
+    async def _initialize_accounts(self) -> None:
+        """ Initialize every account, dropping any that fail. """
+        started = time.perf_counter()
+
+        results = await self._run_bounded(
+            self._initialize_account(account) for account in self.accounts
+        )
+
+        for account, result in zip(list(self.accounts), results):
+            if isinstance(result, Exception):
+                log.error(f"Failed to initialize account: {result!r}", extra={
+                    "account": account.username
+                })
+                await self._discard_account(account)
+
+        log.info(
+            f"Initialized {len(self.accounts)}/{len(results)} accounts "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+
+    async def _initialize_channels(self) -> None:
+        """ Resolve every channel name on one of the accounts. """
+        started = time.perf_counter()
+
+        # Channels may already have been handed over by a parent process.
+        channel_names = [
+            channel_name for channel_name in self._channel_names
+            if self._find_channel_by_login(channel_name) is None
+        ]
+
+        results = await self._run_bounded(
+            self.accounts[0].fetch_channel(channel_name)
+            for channel_name in channel_names
+        )
+
+        for channel_name, channel_data in zip(channel_names, results):
+            if isinstance(channel_data, Exception):
+                log.error(f"Failed to find channel {channel_name}: {channel_data!r}")
+                continue
+
+            if not channel_data:
+                log.warn(f"Channel {channel_name} was not found on Twitch")
+                continue
+            
+            self.add_channel(Channel(channel_data))
+
+        log.info(
+            f"Resolved {len(results)} channel(s), tracking {len(self.channels)} "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+
+    async def _prepare_account(self, account: Account) -> None:
+        """
+        Prepare every channel for the account at once, so the checks can
+        share a GQL request.
+        """
+        channels = list(self.channels)
+
+        results = await asyncio.gather(*[
+            self._prepare_channel(account, channel)
+            for channel in channels
+        ], return_exceptions=True)
+
+        for channel, result in zip(channels, results):
+            if isinstance(result, Exception):
+                log.error(f"Failed to prepare channel: {result!r}", extra={
+                    "channel": channel.name,
+                    "account": account.username
                 })
 
-            elif message["type"] == "stream_down" and channel.is_streaming:
-                channel.stream = None
-                log.info(f"Stopped streaming", extra={
+    async def _prepare_accounts(self) -> None:
+        started = time.perf_counter()
+
+        await self._run_bounded(
+            self._prepare_account(account) for account in self.accounts
+        )
+
+        log.info(
+            f"Checked follows and claims for {len(self.accounts)} accounts "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+
+    async def _prepare_channel(self, account: Account, channel: Channel) -> None:
+        """ Follow the channel if needed and claim any points left waiting. """
+        key = (account.user_id, channel.id)
+
+        # Follows rarely change, so one seen before isn't checked again.
+        if key in self._following:
+            following, claim_id = True, await account.available_points(channel)
+        else:
+            following, claim_id = await asyncio.gather(
+                account.is_following(channel),
+                account.available_points(channel)
+            )
+
+        if not following:
+            await account.follow(channel)
+
+        self._following.add(key)
+
+        if claim_id is not None:
+            await account.claim_points(channel, claim_id)
+
+    def _start_task(self, coroutine: Awaitable) -> asyncio.Task:
+        """ Run a background task that is cancelled when the manager closes. """
+        task = asyncio.get_running_loop().create_task(coroutine)
+
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        return task
+
+    def _load_snapshot(self) -> Optional[Snapshot]:
+        """ Take on the state from the snapshot file, if there is one. """
+        if not self._snapshot_file:
+            return None
+
+        snapshot = Snapshot.load(self._snapshot_file)
+
+        if snapshot is None:
+            return None
+
+        channel_names = {channel_name.lower() for channel_name in self._channel_names}
+
+        for login, channel_data in snapshot.channels.items():
+            if login in channel_names and self._find_channel_by_login(login) is None:
+                self.apply_channel_data(channel_data)
+
+        self._following.update(snapshot.following)
+
+        for (user_id, channel_id), balance in snapshot.balances.items():
+            self._planner.update_balance(user_id, channel_id, balance)
+
+        if snapshot.age() < self._snapshot_max_age:
+            for key, value in snapshot.config.items():
+                if config_cache.peek(key) is None:
+                    config_cache.set(key, value)
+
+        return snapshot
+
+    def _save_snapshot(self) -> None:
+        snapshot = Snapshot()
+
+        snapshot.channels = {
+            channel.name.lower(): channel.to_dict() for channel in self.channels
+            if channel.id not in self._raid_targets
+        }
+        snapshot.following = set(self._following)
+        snapshot.balances = dict(self._planner.balances)
+
+        for key in ("client_id", "spade_url"):
+            value = config_cache.peek(key)
+
+            if value is not None:
+                snapshot.config[key] = value
+
+        snapshot.save(self._snapshot_file)
+
+    async def _save_snapshots(self) -> None:
+        while True:
+            await asyncio.sleep(self._snapshot_interval)
+            self._save_snapshot()
+
+    async def _lookup_channels(self, channel_names: List[str]) -> Dict[str, dict]:
+        """
+        Look channels up `poll_batch_size` at a time, each batch in a single
+        aliased query. Channels that don't exist or whose batch failed are
+        left out.
+        """
+        chunks = [
+            channel_names[index:index + self._poll_batch_size]
+            for index in range(0, len(channel_names), self._poll_batch_size)
+        ]
+
+        results = await self._run_bounded(
+            self.accounts[0].fetch_channels(chunk) for chunk in chunks
+        )
+
+        found = {}
+
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, Exception):
+                log.warning(f"Failed to look up {len(chunk)} channel(s): {result!r}")
+                continue
+
+            found.update({
+                channel_name: channel_data
+                for channel_name, channel_data in result.items()
+                if channel_data
+            })
+
+        return found
+
+    async def _refresh_channels(self) -> None:
+        """ Look every tracked channel up again and apply any changes. """
+        found = await self._lookup_channels([channel.name for channel in self.channels])
+
+        for channel_data in found.values():
+            self.apply_channel_data(channel_data)
+
+    async def _poll_channels(self) -> int:
+        """
+        Bring every channel's stream up to date, returning how many had gone
+        up or down without PubSub saying so. Only those are planned again.
+        """
+        found = await self._lookup_channels([channel.name for channel in self.channels])
+        corrected = 0
+
+        for channel_data in found.values():
+            channel = self._find_channel_by_login(channel_data["login"])
+
+            if channel is None:
+                continue
+
+            was_streaming = channel.is_streaming
+            self._channel_changed(channel, channel.update(channel_data))
+
+            if channel.is_streaming != was_streaming:
+                corrected += 1
+
+                log.info(f"Found the stream {'up' if channel.is_streaming else 'down'} without a PubSub event", extra={
                     "channel": channel.display_name
                 })
 
-        elif topic == "community-points-user-v1":
-            if message["type"] == "points-earned":
-                channel = self._find_channel_by_id(message["data"]["balance"]["channel_id"])
+        return corrected
 
-                log.info(
-                    f"Gained {message['data']['point_gain']['total_points']} points "
-                    f"({message['data']['balance']['balance']} total)",
-                    extra={
-                        "channel": channel.name,
-                        "account": user.username
-                    }
-                )
+    async def _revalidate(self, snapshot: Snapshot) -> None:
+        """
+        Check the state taken from a snapshot while already watching. Channels
+        missing from it are resolved, and if it's stale every channel is
+        looked up again. Every account's claims are checked either way.
+        """
+        try:
+            await self._initialize_channels()
+            await self._listen_raids()
 
-            elif message["type"] == "claim-available":
-                claim = message["data"]["claim"]
-                channel = self._find_channel_by_id(claim["channel_id"])
+            if snapshot.age() > self._snapshot_max_age:
+                await self._refresh_channels()
+
+            # Follows already known are taken on trust, but points left
+            # waiting before the restart are still claimed.
+            await self._prepare_accounts()
+
+            self._save_snapshot()
+        except Exception:
+            log.exception("Failed to revalidate the snapshot")
 
-                await user.claim_points(channel, claim["id"])
-    
     async def run(self) -> None:
-        """ Start watching minutes on all clients. """
+        """ Start watching minutes on all clients, closing them on exit. """
+        try:
+            await self._run()
+        finally:
+            await self.close()
 
+    async def _run(self) -> None:
         # Initialize the channel on one of the clients. By this I mean, find
         # the channel's ID (mainly) and get the broadcast ID. This will then
         # be saved to the `self.channels` array for later use.
         if len(self.accounts) < 1:
             raise Exception("No valid accounts were found")
-        
+
+        self._connector = self._create_connector()
+
+        if self._record_file:
+            self._recorder = TrafficRecorder(self._record_file)
+
+        self._pubsub = PubsubPool(self._endpoints.pubsub, recorder=self._recorder)
+        self._dispatcher.start()
+
+        self._register_gauges()
+        await self._metrics.start()
+
         for account in self.accounts:
-            await account.initialize_user()
-            await account.initialize_websocket(self._update_event)
+            account.set_connector(self._connector)
+
+        snapshot = self._load_snapshot()
         
-        for channel_name in self._channel_names:
-            channel_data = await self.accounts[0].fetch_channel(channel_name)
+        await self._initialize_accounts()
 
-            if not channel_data:
-                log.warn(f"Channel {channel_name} was not found on Twitch")
-                continue
+        if len(self.accounts) < 1:
+            raise Exception("No accounts could be initialized")
+
+        if snapshot is not None and self.channels:
+            log.info(
+                f"Starting from a snapshot of {len(self.channels)} channel(s) "
+                f"taken {snapshot.age():.0f}s ago"
+            )
+
+            self._start_task(self._revalidate(snapshot))
+        else:
+            await self._initialize_channels()
             
-            self.channels.append(Channel(channel_data))
-        
-        if len(self.channels) < 1:
-            raise Exception("No valid channels were found")
-        
-        for account in self.accounts:
-            for channel in self.channels:
-                if not await account.is_following(channel):
-                    await account.follow(channel)
+            if len(self.channels) < 1:
+                raise Exception("No valid channels were found")
+
+            await self._prepare_accounts()
+
+        await self._listen_raids()
 
-                claim_id = await account.available_points(channel)
+        log.debug(f"Listening on {self._pubsub.connection_count} PubSub connection(s)")
 
-                if claim_id is not None:
-                    await account.claim_points(channel, claim_id)
+        if self._snapshot_file:
+            self._start_task(self._save_snapshots())
+
+        if self._poller is not None:
+            self._start_task(self._poller.run(self._poll_channels))
+
+        for account in self.accounts:
+            self._planner.add_account(account.user_id)
         
         log.info("Started the manager loop")
+        self.started.set()
 
-        while True:
-            await asyncio.sleep(60)
+        await self._scheduler.run(self._watch_jobs)
 
-            # Update all the channels while looping over clients.
-            # TODO: Follow raids.
-            # TODO: Mark only two channels per client.
-            tasks = []
+    def _watch_jobs(self) -> List[Job]:
+        """ Build this tick's watch job for every account with channels. """
+        log.debug(f"Event queue: {self._dispatcher.stats()}")
+        log.debug(
+            f"PubSub: {self._pubsub.connection_count} connection(s), "
+            f"{self._pubsub.reconnects} reconnect(s)"
+        )
 
-            for account in self.accounts:
-                for channel in self.channels:
-                    if channel.is_streaming:
-                        tasks.append(account.watch_minute(channel))
-            
-            await asyncio.gather(*tasks)
+        return [
+            (account.user_id, functools.partial(self._watch_account, account))
+            for account in self.accounts
+            if self._planner.channels_for(account.user_id)
+        ]
+
+    async def _watch_account(self, account: Account) -> None:
+        """
+        Watch a minute on the account's channels. They are looked up when the
+        job runs rather than at the tick, as the job can start up to a whole
+        period later.
+        """
+        channels = [
+            self._channels_by_id[channel_id]
+            for channel_id in self._planner.channels_for(account.user_id)
+            if channel_id in self._channels_by_id
+        ]
+
+        if channels:
+            await account.watch_minutes(channels)
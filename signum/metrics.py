@@ -0,0 +1,264 @@
+"""
+
+Counters and latency histograms for the hot paths, rendered in Prometheus'
+text format. They can be served over HTTP on a local port and written out to
+a file every so often.
+
+"""
+
+import asyncio
+import bisect
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f"{name}=\"{_escape(value)}\"" for name, value in zip(names, values)]
+
+    if extra:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+
+    def header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type_name}"
+        ]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        super().__init__(name, description, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, labels)} {value}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """
+    A value read from `function` whenever the metrics are rendered. With
+    label names, `function` returns a value for each tuple of labels.
+    """
+    type_name = "gauge"
+
+    def __init__(self, name: str, description: str, function: Callable[[], Any], label_names: Sequence[str] = ()):
+        super().__init__(name, description, label_names)
+        self.function = function
+
+    def render(self) -> List[str]:
+        try:
+            if not self.label_names:
+                return [f"{self.name} {self.function()}"]
+
+            return [
+                f"{self.name}{_format_labels(self.label_names, labels)} {value}"
+                for labels, value in self.function().items()
+            ]
+        except Exception as error:
+            log.debug(f"Failed to read gauge {self.name}: {error!r}")
+            return []
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, description, label_names)
+
+        self.buckets = tuple(sorted(buckets))
+
+        # Per label set: a count for each bucket plus one for +Inf, then the sum.
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        entry = self._values.get(labels)
+
+        if entry is None:
+            entry = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def render(self) -> List[str]:
+        lines = []
+
+        for labels, entry in self._values.items():
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + (float("inf"),), entry[:-1]):
+                cumulative += count
+                bound_label = "+Inf" if bound == float("inf") else repr(bound)
+                extra = f"le=\"{bound_label}\""
+
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.label_names, labels, extra)} {cumulative}"
+                )
+
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {entry[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, description, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, description, label_names, buckets))
+
+    def gauge(
+        self,
+        name: str,
+        description: str,
+        function: Callable[[], Any],
+        label_names: Sequence[str] = ()
+    ) -> Gauge:
+        """ Register a gauge, replacing any earlier one with the same name. """
+        return self._register(Gauge(name, description, function, label_names))
+
+    def render(self) -> str:
+        lines = []
+
+        for metric in self._metrics.values():
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+GQL_OPERATIONS = registry.counter("signum_gql_operations_total", "GQL operations by name and result", ("operation", "result"))
+GQL_OPERATION_SECONDS = registry.histogram("signum_gql_operation_seconds", "Time from a GQL operation being made to its result", ("operation",))
+GQL_REQUESTS = registry.counter("signum_gql_requests_total", "GQL HTTP requests by result", ("result",))
+GQL_BATCH_SIZE = registry.histogram("signum_gql_batch_size", "GQL operations sent per HTTP request", buckets=(1, 2, 5, 10, 20, 35, 50))
+
+SPADE_POSTS = registry.counter("signum_spade_posts_total", "Spade requests by result", ("result",))
+SPADE_EVENTS = registry.counter("signum_spade_events_total", "Minute-watched events sent to Spade")
+SPADE_SECONDS = registry.histogram("signum_spade_post_seconds", "Time taken by Spade requests")
+
+PUBSUB_MESSAGES = registry.counter("signum_pubsub_messages_total", "PubSub messages received by topic", ("topic",))
+PUBSUB_RECONNECTS = registry.counter("signum_pubsub_reconnects_total", "PubSub reconnects")
+
+EVENT_SECONDS = registry.histogram("signum_event_seconds", "Time from a PubSub message arriving to it being handled", ("topic", "type"))
+CLAIM_SECONDS = registry.histogram("signum_claim_latency_seconds", "Time from claim-available arriving to the claim being made")
+
+
+class MetricsExporter:
+    """ Serves the metrics over HTTP and dumps them to a file periodically. """
+    def __init__(
+        self,
+        metrics: Registry = registry,
+        host: str = "127.0.0.1",
+        port: Optional[int] = None,
+        path: Optional[str] = None,
+        interval: float = 60.0
+    ):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.path = path
+        self.interval = interval
+
+        self._runner: Optional[web.AppRunner] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    async def _serve(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=self.metrics.render(),
+            content_type="text/plain",
+            charset="utf-8",
+            headers={"X-Content-Type-Options": "nosniff"}
+        )
+
+    def dump(self) -> None:
+        """ Write the metrics to the file, replacing it all at once. """
+        temporary_path = f"{self.path}.tmp"
+
+        try:
+            with open(temporary_path, "w", encoding="utf-8") as file_object:
+                file_object.write(self.metrics.render())
+
+            os.replace(temporary_path, self.path)
+        except OSError as error:
+            log.warning(f"Failed to write metrics to {self.path}: {error}")
+
+    async def _write(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.dump()
+
+    async def start(self) -> None:
+        if self.port is not None:
+            app = web.Application()
+            app.router.add_get("/metrics", self._serve)
+
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+
+            log.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+        if self.path is not None:
+            self._writer = asyncio.get_running_loop().create_task(self._write())
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.cancel()
+            self.dump()
+
+        if self._runner is not None:
+            await self._runner.cleanup()
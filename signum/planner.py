@@ -0,0 +1,154 @@
+"""
+
+Decides which live channels each account watches. Twitch only credits watch
+time for two streams at once, so sending minutes for any more than that is
+wasted. Accounts are only planned again when something that affects them
+changes, such as one of their channels going offline, a better channel going
+live or a balance changing, rather than every account being planned from
+scratch.
+
+"""
+
+import heapq
+import logging
+from typing import Dict, List, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+
+class ChannelPlanner:
+    def __init__(self, max_channels: int = 2):
+        self.max_channels = max(1, max_channels)
+
+        self._priorities: Dict[int, int] = {}
+        self._live: Set[int] = set()
+
+        self._accounts: Set[int] = set()
+        self._balances: Dict[Tuple[int, int], int] = {}
+        self._streaks: Set[Tuple[int, int]] = set()
+
+        # Account to its channels, and channel back to its accounts.
+        self._assignments: Dict[int, List[int]] = {}
+        self._members: Dict[int, Set[int]] = {}
+
+    @property
+    def balances(self) -> Dict[Tuple[int, int], int]:
+        """ Last seen balances, keyed by (account ID, channel ID). """
+        return self._balances
+
+    def _key(self, account_id: int, channel_id: int) -> tuple:
+        """
+        Sort key for a channel from an account's point of view. Channels with
+        an active watch streak come first, then the highest priority, then
+        the one the account has the fewest points on.
+        """
+        return (
+            (account_id, channel_id) not in self._streaks,
+            -self._priorities.get(channel_id, 0),
+            self._balances.get((account_id, channel_id), 0),
+            channel_id
+        )
+
+    def _assign(self, account_id: int, channel_ids: List[int]) -> None:
+        for channel_id in self._assignments.get(account_id, []):
+            self._members.get(channel_id, set()).discard(account_id)
+
+        self._assignments[account_id] = channel_ids
+
+        for channel_id in channel_ids:
+            self._members.setdefault(channel_id, set()).add(account_id)
+
+    def _plan(self, account_id: int) -> None:
+        best = heapq.nsmallest(
+            self.max_channels,
+            self._live,
+            key=lambda channel_id: self._key(account_id, channel_id)
+        )
+
+        self._assign(account_id, best)
+
+    def _replan(self, account_id: int, channel_id: int) -> None:
+        """ Plan the account again after its key for the channel changed. """
+        if account_id in self._accounts and channel_id in self._live:
+            self._plan(account_id)
+
+    def channels_for(self, account_id: int) -> List[int]:
+        return self._assignments.get(account_id, [])
+
+    def add_account(self, account_id: int) -> None:
+        self._accounts.add(account_id)
+        self._plan(account_id)
+
+    def remove_account(self, account_id: int) -> None:
+        self._accounts.discard(account_id)
+        self._assign(account_id, [])
+        self._assignments.pop(account_id, None)
+        self._streaks = {pair for pair in self._streaks if pair[0] != account_id}
+
+    def add_channel(self, channel_id: int, priority: int = 0, live: bool = False) -> None:
+        self._priorities[channel_id] = priority
+
+        if live:
+            self.set_live(channel_id, True)
+
+    def remove_channel(self, channel_id: int) -> None:
+        self.set_live(channel_id, False)
+        self._clear_streaks(channel_id)
+        self._priorities.pop(channel_id, None)
+        self._members.pop(channel_id, None)
+
+    def update_balance(self, account_id: int, channel_id: int, balance: int) -> None:
+        if self._balances.get((account_id, channel_id)) == balance:
+            return
+
+        self._balances[(account_id, channel_id)] = balance
+        self._replan(account_id, channel_id)
+
+    def mark_streak(self, account_id: int, channel_id: int, active: bool = True) -> None:
+        if active == ((account_id, channel_id) in self._streaks):
+            return
+
+        if active:
+            self._streaks.add((account_id, channel_id))
+        else:
+            self._streaks.discard((account_id, channel_id))
+
+        self._replan(account_id, channel_id)
+
+    def _clear_streaks(self, channel_id: int) -> None:
+        """ Streaks only last for one stream, so they end with it. """
+        self._streaks = {pair for pair in self._streaks if pair[1] != channel_id}
+
+    def set_live(self, channel_id: int, live: bool) -> int:
+        """
+        Mark a channel as online or offline and plan any accounts affected
+        by it again. Returns the number of accounts that were planned.
+        """
+        if live == (channel_id in self._live):
+            return 0
+
+        if not live:
+            self._live.discard(channel_id)
+            self._clear_streaks(channel_id)
+            affected = list(self._members.pop(channel_id, ()))
+
+        else:
+            self._live.add(channel_id)
+            affected = []
+
+            for account_id in self._accounts:
+                assigned = self._assignments.get(account_id, [])
+
+                # Only accounts with a free slot, or a worse channel than the
+                # new one, have anything to gain from it.
+                if len(assigned) < self.max_channels or self._key(account_id, channel_id) < max(
+                    self._key(account_id, assigned_id) for assigned_id in assigned
+                ):
+                    affected.append(account_id)
+
+        for account_id in affected:
+            self._plan(account_id)
+
+        log.debug(f"Planned {len(affected)} account(s) after channel {channel_id} changed")
+
+        return len(affected)
@@ -0,0 +1,57 @@
+"""
+
+Looks the status of every tracked channel up every so often, in case PubSub
+missed a stream going up or down. The interval shrinks while polls keep
+finding channels that PubSub got wrong, and grows back out while they don't.
+
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+log = logging.getLogger(__name__)
+
+
+class StatusPoller:
+    def __init__(
+        self,
+        min_interval: float = 60.0,
+        max_interval: float = 600.0,
+        backoff: float = 1.5
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+
+        self.interval = min_interval
+
+        self.polls = 0
+        self.corrections = 0
+
+    def _adapt(self, corrected: int) -> None:
+        if corrected:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+
+    async def run(self, poll: Callable[[], Awaitable[int]]) -> None:
+        """
+        Call `poll` forever, which should return how many channels it found
+        in the wrong state. A failed poll is logged and the next one goes
+        ahead as usual.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+
+            try:
+                corrected = await poll()
+            except Exception:
+                log.exception("Failed to poll channel statuses")
+                corrected = 0
+
+            self.polls += 1
+            self.corrections += corrected
+            self._adapt(corrected)
+
+            log.debug(f"Polled channel statuses, {corrected} corrected, next in {self.interval:.0f}s")
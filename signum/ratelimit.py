@@ -0,0 +1,324 @@
+"""
+
+Token bucket rate limits for requests to Twitch, with a budget for each host
+shared by every account and a smaller budget for each account. Requests
+waiting on a host are let through in priority order, so claims go ahead of
+follow checks, which go ahead of watched minutes.
+
+Requests in flight to each host are also limited, with the limit raised
+slowly while responses come back quickly and cut in half on timeouts, 429s
+and server errors (AIMD), so that it settles on what Twitch will take.
+
+"""
+
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import time
+from typing import AsyncIterator, Dict, Hashable, List, Optional, Tuple
+
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+PRIORITY_CLAIM = 0
+PRIORITY_CHECK = 1
+PRIORITY_WATCH = 2
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """ Seconds until a token is available. """
+        self._refill()
+
+        return 0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self) -> None:
+        self._tokens -= 1
+
+    def reserve(self) -> float:
+        """
+        Take a token, going into debt if there are none, and return how long
+        to wait before using it. Callers waiting together are spaced out.
+        """
+        self._refill()
+        self._tokens -= 1
+
+        return 0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class _HostLane:
+    """ Lets waiting requests for one host through in priority order. """
+    def __init__(self, host: str, bucket: TokenBucket):
+        self.host = host
+        self.bucket = bucket
+        self.paused_until = 0.0
+
+        self._waiting: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._waiting)
+
+    async def acquire(self, priority: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._counter), future))
+
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.get_running_loop().create_task(self._run())
+
+        await future
+
+    async def _run(self) -> None:
+        while self._waiting:
+            wait = max(self.paused_until - time.monotonic(), self.bucket.delay())
+
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            _, _, future = heapq.heappop(self._waiting)
+
+            # The caller gave up waiting, so the token goes to the next one.
+            if future.done():
+                continue
+
+            self.bucket.take()
+            future.set_result(None)
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        host_rate: float = 50,
+        host_burst: float = 100,
+        account_rate: float = 5,
+        account_burst: float = 20
+    ):
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+
+        self._hosts: Dict[str, _HostLane] = {}
+        self._accounts: Dict[Tuple[str, Hashable], TokenBucket] = {}
+
+    def _lane(self, host: str) -> _HostLane:
+        lane = self._hosts.get(host)
+
+        if lane is None:
+            lane = self._hosts[host] = _HostLane(host, TokenBucket(self.host_rate, self.host_burst))
+
+        return lane
+
+    def depths(self) -> Dict[str, int]:
+        """ Requests waiting on each host. """
+        return {host: lane.depth for host, lane in self._hosts.items()}
+
+    async def acquire(self, host: str, account: Hashable, priority: int = PRIORITY_CHECK) -> None:
+        """ Wait until a request to `host` for `account` is allowed. """
+        if account is not None:
+            key = (host, account)
+            bucket = self._accounts.get(key)
+
+            if bucket is None:
+                bucket = self._accounts[key] = TokenBucket(self.account_rate, self.account_burst)
+
+            wait = bucket.reserve()
+
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        await self._lane(host).acquire(priority)
+
+    def pause(self, host: str, seconds: float) -> None:
+        """ Hold every request to `host` back, such as after a 429. """
+        lane = self._lane(host)
+        lane.paused_until = max(lane.paused_until, time.monotonic() + seconds)
+
+        log.warning(f"Holding requests to {host} back for {seconds:.1f}s")
+
+
+def is_overloaded(error: BaseException) -> bool:
+    """ Whether a request failed because the host has more than it can take. """
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+
+    return isinstance(error, aiohttp.ClientResponseError) and (error.status == 429 or error.status >= 500)
+
+
+class _HostConcurrency:
+    """ The in-flight limit for one host, and the requests waiting under it. """
+    def __init__(
+        self,
+        host: str,
+        limit: float,
+        minimum: float,
+        maximum: float,
+        latency_target: float,
+        decrease: float
+    ):
+        self.host = host
+        self.limit = limit
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.decrease = decrease
+
+        self.in_flight = 0
+        self.decreases = 0
+
+        self._waiting: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._decreased_at = 0.0
+
+    @property
+    def depth(self) -> int:
+        return len(self._waiting)
+
+    def _has_room(self) -> bool:
+        return self.in_flight < max(1, int(self.limit))
+
+    async def acquire(self, priority: int) -> float:
+        """ Wait for a slot, returning when the request was let through. """
+        if not self._waiting and self._has_room():
+            self.in_flight += 1
+            return time.monotonic()
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._counter), future))
+
+        # Only given up waiters may be ahead, in which case it's let through.
+        self._wake()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Cancelled after being handed a slot, so pass it on.
+            if future.done() and not future.cancelled():
+                self.in_flight -= 1
+                self._wake()
+
+            raise
+
+        return time.monotonic()
+
+    def _wake(self) -> None:
+        while self._waiting and self._has_room():
+            _, _, future = heapq.heappop(self._waiting)
+
+            if future.done():
+                continue
+
+            self.in_flight += 1
+            future.set_result(None)
+
+    def release(self, started: float, succeeded: bool, overloaded: bool) -> None:
+        busy = self.in_flight * 2 >= self.limit
+        self.in_flight -= 1
+
+        if overloaded:
+            # Requests sent before the last cut were sent under the old
+            # limit, so their failures don't count against the new one.
+            if started >= self._decreased_at:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self._decreased_at = time.monotonic()
+                self.decreases += 1
+
+                log.info(f"Cut requests in flight to {self.host} to {self.limit:.1f}")
+
+        # Only raised while the limit is actually being used, and by one for
+        # every `limit` quick responses.
+        elif succeeded and busy and time.monotonic() - started <= self.latency_target:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+        self._wake()
+
+
+class ConcurrencyLimiter:
+    def __init__(
+        self,
+        initial: float = 10,
+        minimum: float = 1,
+        maximum: float = 50,
+        latency_target: float = 1.0,
+        decrease: float = 0.5
+    ):
+        self.initial = initial
+        self.minimum = max(1.0, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.latency_target = latency_target
+        self.decrease = decrease
+
+        self._hosts: Dict[str, _HostConcurrency] = {}
+
+    def _host(self, host: str) -> _HostConcurrency:
+        concurrency = self._hosts.get(host)
+
+        if concurrency is None:
+            concurrency = self._hosts[host] = _HostConcurrency(
+                host,
+                min(self.maximum, max(self.minimum, self.initial)),
+                self.minimum,
+                self.maximum,
+                self.latency_target,
+                self.decrease
+            )
+
+        return concurrency
+
+    def limits(self) -> Dict[str, float]:
+        """ The current in-flight limit for each host. """
+        return {host: concurrency.limit for host, concurrency in self._hosts.items()}
+
+    def in_flight(self) -> Dict[str, int]:
+        return {host: concurrency.in_flight for host, concurrency in self._hosts.items()}
+
+    def depths(self) -> Dict[str, int]:
+        """ Requests waiting for a slot on each host. """
+        return {host: concurrency.depth for host, concurrency in self._hosts.items()}
+
+    @contextlib.asynccontextmanager
+    async def slot(self, host: str, priority: int = PRIORITY_CHECK) -> AsyncIterator[None]:
+        """ Hold one of the host's slots while making a request. """
+        concurrency = self._host(host)
+        started = await concurrency.acquire(priority)
+
+        succeeded, overloaded = False, False
+
+        try:
+            yield
+            succeeded = True
+        except BaseException as error:
+            overloaded = is_overloaded(error)
+            raise
+        finally:
+            concurrency.release(started, succeeded, overloaded)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """ Read a Retry-After header given in seconds. """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
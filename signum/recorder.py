@@ -0,0 +1,81 @@
+"""
+
+Records the raw PubSub frames the accounts receive, so that real traffic can
+be replayed through the manager later by `benchmarks/replay.py`. Each line
+holds the seconds since recording started and the frame, separated by a tab,
+and the file is gzipped if its name ends in `.gz`. Frames are compressed and
+written on a background thread, so the event loop only timestamps them.
+
+"""
+
+import gzip
+import logging
+import queue
+import threading
+import time
+from typing import IO, Iterator, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+
+def _open(path: str, mode: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+
+    return open(path, mode, encoding="utf-8")
+
+
+class TrafficRecorder:
+    def __init__(self, path: str):
+        self.path = path
+        self.frames = 0
+
+        self._file = _open(path, "w")
+        self._started = time.monotonic()
+
+        # (seconds since recording started, frame), or None to stop.
+        self._frames: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write_frames, name="signum-recorder", daemon=True)
+        self._thread.start()
+
+    def write(self, frame: str) -> None:
+        self._frames.put((time.monotonic() - self._started, frame))
+        self.frames += 1
+
+    def _write_frames(self) -> None:
+        while True:
+            entry: Optional[Tuple[float, str]] = self._frames.get()
+
+            if entry is None:
+                break
+
+            offset, frame = entry
+
+            # Frames are single JSON documents, so any newline in one is only
+            # whitespace between tokens.
+            frame = frame.strip().replace("\n", " ")
+
+            try:
+                self._file.write(f"{offset:.6f}\t{frame}\n")
+            except OSError as error:
+                log.warning(f"Failed to record a PubSub frame to {self.path}: {error}")
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._frames.put(None)
+            self._thread.join()
+
+        if not self._file.closed:
+            self._file.close()
+
+            log.info(f"Recorded {self.frames} PubSub frame(s) to {self.path}")
+
+
+def read_recording(path: str) -> Iterator[Tuple[float, str]]:
+    """ The (seconds since recording started, frame) pairs in a recording. """
+    with _open(path, "r") as file_object:
+        for line in file_object:
+            offset, _, frame = line.rstrip("\n").partition("\t")
+
+            if frame:
+                yield float(offset), frame
@@ -0,0 +1,130 @@
+"""
+
+Runs the per-account watch jobs once a minute. Ticks are measured against a
+monotonic deadline, so the time spent sending doesn't push the next tick back,
+and every account gets a stable offset into the minute so that requests are
+spread out rather than all sent at the same instant.
+
+"""
+
+import asyncio
+import logging
+import zlib
+from typing import Awaitable, Callable, Dict, Hashable, List, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+Job = Tuple[Hashable, Callable[[], Awaitable[None]]]
+
+
+class WatchScheduler:
+    def __init__(
+        self,
+        period: float = 60.0,
+        max_in_flight: int = 50,
+        late_threshold: float = 1.0
+    ):
+        self.period = period
+        self.late_threshold = late_threshold
+
+        self._semaphore = asyncio.Semaphore(max(1, max_in_flight))
+        # Every job for a key that hasn't finished, waiting or running.
+        self._running: Dict[Hashable, Set[asyncio.Task]] = {}
+
+        self.ticks = 0
+        self.late_ticks = 0
+        self.missed_ticks = 0
+        self.skipped_jobs = 0
+
+    def offset(self, key: Hashable) -> float:
+        """ Stable offset into the period for the given key. """
+        return zlib.crc32(str(key).encode("utf-8")) / 2 ** 32 * self.period
+
+    async def _run_job(
+        self,
+        key: Hashable,
+        job: Callable[[], Awaitable[None]],
+        start: float,
+        previous: List[asyncio.Task]
+    ) -> None:
+        loop = asyncio.get_running_loop()
+
+        await asyncio.sleep(max(0, start - loop.time()))
+
+        # Still sending from the last tick, so don't stack another on it.
+        if any(not task.done() for task in previous):
+            self.skipped_jobs += 1
+            log.warning(f"Watch job for {key} is still running, skipping this tick")
+            return
+
+        async with self._semaphore:
+            try:
+                await job()
+            except Exception:
+                log.exception(f"Watch job for {key} failed")
+
+    def _schedule(self, jobs: List[Job], deadline: float) -> None:
+        loop = asyncio.get_running_loop()
+
+        for key, job in jobs:
+            # Whether the last job has finished is only checked once this one
+            # is due, since a job late in the period often runs past the tick.
+            tasks = self._running.setdefault(key, set())
+            task = loop.create_task(self._run_job(key, job, deadline + self.offset(key), list(tasks)))
+
+            tasks.add(task)
+            task.add_done_callback(lambda task, key=key: self._discard(key, task))
+
+    def _discard(self, key: Hashable, task: asyncio.Task) -> None:
+        tasks = self._running.get(key)
+
+        if tasks is not None:
+            tasks.discard(task)
+
+            if not tasks:
+                del self._running[key]
+
+    async def cancel(self, key: Hashable) -> None:
+        """ Cancel the jobs for `key` that are waiting or running, and wait for them to stop. """
+        tasks = self._running.pop(key, set())
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def run(self, get_jobs: Callable[[], List[Job]]) -> None:
+        """ Call `get_jobs` every period and run each job at its offset. """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        tick = 1
+
+        try:
+            while True:
+                deadline = start + tick * self.period
+
+                await asyncio.sleep(max(0, deadline - loop.time()))
+
+                lateness = loop.time() - deadline
+
+                if lateness >= self.period:
+                    missed = int(lateness // self.period)
+
+                    self.missed_ticks += missed
+                    tick += missed
+                    deadline += missed * self.period
+
+                    log.warning(f"Missed {missed} watch tick(s)")
+
+                elif lateness > self.late_threshold:
+                    self.late_ticks += 1
+                    log.warning(f"Watch tick started {lateness:.2f}s late")
+
+                self.ticks += 1
+                tick += 1
+
+                self._schedule(get_jobs(), deadline)
+        finally:
+            for tasks in self._running.values():
+                for task in tasks:
+                    task.cancel()
@@ -0,0 +1,105 @@
+"""
+
+A compact copy of what the manager learnt at startup: the channels and their
+stream state, which accounts follow which channels and their last seen
+balances. Loading it lets a restart begin watching
+straight away and check anything that has gone stale in the background.
+
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+class Snapshot:
+    def __init__(self):
+        self.saved_at: float = 0
+
+        # Channel login to its GQL data.
+        self.channels: Dict[str, dict] = {}
+
+        # State for each (user ID, channel ID) pair.
+        self.following: Set[Tuple[int, int]] = set()
+        self.balances: Dict[Tuple[int, int], int] = {}
+
+        self.config: Dict[str, str] = {}
+
+    def age(self) -> float:
+        return time.time() - self.saved_at
+
+    def to_dict(self) -> dict:
+        accounts: Dict[int, dict] = {}
+
+        for user_id, channel_id in self.following:
+            accounts.setdefault(user_id, {"following": [], "balances": {}})
+            accounts[user_id]["following"].append(channel_id)
+
+        for (user_id, channel_id), balance in self.balances.items():
+            accounts.setdefault(user_id, {"following": [], "balances": {}})
+            accounts[user_id]["balances"][str(channel_id)] = balance
+
+        return {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": self.saved_at,
+            "config": self.config,
+            "channels": list(self.channels.values()),
+            "accounts": {str(user_id): account for user_id, account in accounts.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Snapshot":
+        snapshot = cls()
+        snapshot.saved_at = data.get("saved_at", 0)
+        snapshot.config = data.get("config") or {}
+
+        for channel_data in data.get("channels", []):
+            snapshot.channels[channel_data["login"].lower()] = channel_data
+
+        for user_id, account in data.get("accounts", {}).items():
+            user_id = int(user_id)
+
+            for channel_id in account.get("following", []):
+                snapshot.following.add((user_id, int(channel_id)))
+
+            for channel_id, balance in account.get("balances", {}).items():
+                snapshot.balances[(user_id, int(channel_id))] = balance
+
+        return snapshot
+
+    def save(self, path: str) -> None:
+        """ Write the snapshot, replacing the old file all at once. """
+        self.saved_at = time.time()
+        temporary_path = f"{path}.tmp"
+
+        try:
+            with open(temporary_path, "w", encoding="utf-8") as file_object:
+                json.dump(self.to_dict(), file_object, separators=(",", ":"))
+
+            os.replace(temporary_path, path)
+        except OSError as error:
+            log.warning(f"Failed to write snapshot {path}: {error}")
+
+    @classmethod
+    def load(cls, path: str) -> Optional["Snapshot"]:
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with open(path, "r", encoding="utf-8") as file_object:
+                data = json.load(file_object)
+        except (OSError, ValueError) as error:
+            log.warning(f"Failed to read snapshot {path}: {error}")
+            return None
+
+        if data.get("version") != SNAPSHOT_VERSION:
+            log.warning(f"Ignoring snapshot {path} from a different version")
+            return None
+
+        return cls.from_dict(data)
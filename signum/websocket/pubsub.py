@@ -1,75 +1,387 @@
 import asyncio
-import json
 import logging
+import random
 import time
-from typing import Optional
+from typing import Awaitable, Callable, Dict, List, Optional, Set
 
 import websockets
 import websockets.client
+import websockets.exceptions
 
+from .. import codec
+from ..metrics import PUBSUB_MESSAGES, PUBSUB_RECONNECTS
+from ..recorder import TrafficRecorder
 from ..util import generate_nonce
 
 log = logging.getLogger(__name__)
 
+# Twitch refuses to LISTEN to more than 50 topics on one connection.
+MAX_TOPICS_PER_CONNECTION = 50
+
+class PubsubReconnect(Exception):
+    """ Raised when the connection needs to be opened again. """
+
+
 class Pubsub:
-    def __init__(self):
+    def __init__(
+        self,
+        url: str = "wss://pubsub-edge.twitch.tv/v1",
+        ping_interval: float = 4 * 60,
+        pong_timeout: float = 10,
+        backoff_base: float = 1,
+        backoff_cap: float = 120,
+        recorder: Optional[TrafficRecorder] = None
+    ):
         self._websocket: Optional[websockets.client.WebSocketClientProtocol] = None
+        self._url = url
 
-        self._initialized = False
+        self._ready = asyncio.Event()
+        self._closed = False
         self._event_callback = None
+
+        # Every topic this connection listens to, mapped to its auth token,
+        # and the ones LISTENed to since the socket was last opened.
+        self._topics: Dict[str, str] = {}
+        self._listened: Set[str] = set()
+
+        self.ping_interval = ping_interval
+        self.pong_timeout = pong_timeout
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.recorder = recorder
+
+        self._last_ping: float = 0
+        self._last_pong: float = 0
+
+        self.reconnects = 0
     
     @property
     def initialized(self) -> bool:
-        return self._initialized
+        return self._ready.is_set()
+
+    async def wait_until_ready(self) -> None:
+        """ Wait until the connection has been opened and pinged. """
+        await self._ready.wait()
+
+    @property
+    def topic_count(self) -> int:
+        return len(self._topics)
     
     def set_event_callback(self, function) -> None:
         self._event_callback = function
     
     async def ping(self):
-        await self._websocket.send(json.dumps({
+        await self._websocket.send(codec.dumps({
             "type": "PING"
         }))
+
+        self._last_ping = time.monotonic()
     
-    async def listen(self, topic: str, target_id: str, authorization_token: str):
-        await self._websocket.send(json.dumps({
+    def reserve(self, topics: List[str], authorization_token: str) -> None:
+        """ Record topics as taken on this connection before listening. """
+        for topic in topics:
+            self._topics[topic] = authorization_token
+
+    async def listen_topics(self, topics: List[str], authorization_token: str):
+        """ Listen to several full topic names with one LISTEN message. """
+        self.reserve(topics, authorization_token)
+
+        await self.wait_until_ready()
+
+        # Opening the socket may already have replayed these topics.
+        topics = [topic for topic in topics if topic not in self._listened]
+
+        if topics:
+            await self._send_listen(topics, authorization_token)
+
+    async def _send_listen(self, topics: List[str], authorization_token: str):
+        self._listened.update(topics)
+
+        await self._websocket.send(codec.dumps({
             "type": "LISTEN",
             "nonce": generate_nonce(30),
             "data": {
-                "topics": [
-                    f"{topic}.{target_id}"
-                ],
+                "topics": topics,
                 "auth_token": authorization_token
             }
         }))
 
+    async def unlisten_topics(self, topics: List[str]):
+        """ Stop listening to topics, freeing their slots on this connection. """
+        topics_by_token: Dict[str, List[str]] = {}
+
+        for topic in topics:
+            authorization_token = self._topics.pop(topic, None)
+
+            if authorization_token is not None and topic in self._listened:
+                self._listened.discard(topic)
+                topics_by_token.setdefault(authorization_token, []).append(topic)
+
+        # If the socket is down, dropping the topics is enough to stop them
+        # being replayed when it opens again.
+        if not self.initialized:
+            return
+
+        for authorization_token, token_topics in topics_by_token.items():
+            await self._websocket.send(codec.dumps({
+                "type": "UNLISTEN",
+                "nonce": generate_nonce(30),
+                "data": {
+                    "topics": token_topics,
+                    "auth_token": authorization_token
+                }
+            }))
+
+    async def close(self):
+        self._closed = True
+
+        if self._websocket is not None:
+            await self._websocket.close()
+
     async def initialize(self):
+        """ Open the connection and listen to every known topic again. """
+        self._websocket = await websockets.client.connect(self._url)
+
+        self._listened.clear()
+
         await self.ping()
+        self._last_pong = self._last_ping
+
+        topics_by_token: Dict[str, List[str]] = {}
+
+        for topic, authorization_token in self._topics.items():
+            topics_by_token.setdefault(authorization_token, []).append(topic)
+
+        for authorization_token, topics in topics_by_token.items():
+            await self._send_listen(topics, authorization_token)
 
-        self._initialized = True
+        self._ready.set()
     
     async def process(self, message: str):
         processed_message = message.strip()
-        processed_data = json.loads(processed_message)
+        processed_data = codec.loads(processed_message)
+
+        # Formatted later, and only if the record is actually written.
+        log.debug("%s", processed_data)
+
+        message_type = processed_data.get("type")
+
+        if message_type == "MESSAGE":
+            topic = processed_data.get("data", {}).get("topic", "")
+            PUBSUB_MESSAGES.inc(topic.rsplit(".", 1)[0])
+
+            # Lets handlers measure how long the message waited.
+            processed_data["received_at"] = time.monotonic()
+        else:
+            PUBSUB_MESSAGES.inc(message_type or "")
+
+        if message_type == "PONG":
+            self._last_pong = time.monotonic()
+            return
 
-        log.debug(processed_data)
+        if message_type == "RECONNECT":
+            raise PubsubReconnect("Twitch asked for a reconnect")
+
+        if message_type == "RESPONSE" and processed_data.get("error"):
+            log.warning(f"PubSub request failed: {processed_data['error']}")
 
         if self._event_callback:
             await self._event_callback(processed_data)
 
-    async def run(self):
-        last_ping = time.time()
-        self._websocket = await websockets.client.connect("wss://pubsub-edge.twitch.tv/v1")
-        
+    async def _receive(self):
         while True:
             try:
-                if not self._initialized:
-                    await self.initialize()
+                message = await asyncio.wait_for(self._websocket.recv(), timeout=self.pong_timeout)
 
-                message = await asyncio.wait_for(self._websocket.recv(), timeout=10)
+                if self.recorder is not None:
+                    self.recorder.write(message)
 
                 await self.process(message)
 
             except asyncio.TimeoutError:
-                if last_ping + (4 * 60) < time.time():
-                    await self.ping()
-                    last_ping = time.time()
+                pass
+
+            now = time.monotonic()
+
+            if self._last_pong < self._last_ping and now - self._last_ping > self.pong_timeout:
+                raise PubsubReconnect("No PONG received in time")
+
+            # Jitter the interval so the connections don't all ping together.
+            if now - self._last_ping > self.ping_interval * random.uniform(0.9, 1.0):
+                await self.ping()
+
+    async def run(self):
+        """
+        Keep the connection open for as long as it isn't closed, reconnecting
+        with jittered exponential backoff whenever it drops.
+        """
+        failures = 0
+
+        while not self._closed:
+            try:
+                await self.initialize()
+                failures = 0
+
+                await self._receive()
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as error:
+                if self._closed:
+                    break
+
+                log.warning(f"PubSub connection lost: {error!r}")
+
+            finally:
+                self._ready.clear()
+
+                if self._websocket is not None:
+                    await self._websocket.close()
+
+            # Full jitter, so that a Twitch-wide outage doesn't have every
+            # connection come back at the same moment.
+            delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** failures))
+            failures += 1
+            self.reconnects += 1
+            PUBSUB_RECONNECTS.inc()
+
+            log.info(f"Reconnecting to PubSub in {delay:.1f}s (reconnect #{self.reconnects})")
+
+            await asyncio.sleep(delay)
+
+
+class PubsubPool:
+    """
+    Packs the topics of many accounts onto as few PubSub connections as
+    Twitch allows, opening a new connection only once the others are full.
+    Each LISTEN carries its own auth token, so one connection can serve many
+    accounts, and incoming messages are routed back by their topic.
+    """
+    def __init__(
+        self,
+        url: str = "wss://pubsub-edge.twitch.tv/v1",
+        max_topics: int = MAX_TOPICS_PER_CONNECTION,
+        listen_timeout: float = 30.0,
+        recorder: Optional[TrafficRecorder] = None
+    ):
+        self.url = url
+        self.max_topics = max_topics
+        self.listen_timeout = listen_timeout
+        self.recorder = recorder
+
+        self._connections: List[Pubsub] = []
+        self._tasks: Dict[Pubsub, asyncio.Task] = {}
+        self._routes: Dict[str, Callable[[dict], Awaitable[None]]] = {}
+        self._owners: Dict[str, Pubsub] = {}
+
+    @property
+    def connection_count(self) -> int:
+        return len(self._connections)
+
+    @property
+    def reconnects(self) -> int:
+        return sum(connection.reconnects for connection in self._connections)
+
+    def _acquire(self) -> Pubsub:
+        """ Find a connection with a free topic slot, or open a new one. """
+        for connection in self._connections:
+            if connection.topic_count < self.max_topics:
+                return connection
+
+        connection = Pubsub(self.url, recorder=self.recorder)
+        connection.set_event_callback(self._route)
+
+        self._tasks[connection] = asyncio.get_event_loop().create_task(connection.run())
+
+        self._connections.append(connection)
+
+        log.debug(f"Opened PubSub connection #{len(self._connections)}")
+
+        return connection
+
+    async def listen(
+        self,
+        topics: List[str],
+        authorization_token: str,
+        callback: Callable[[dict], Awaitable[None]]
+    ) -> None:
+        """
+        Listen to the given topics, sending their messages to `callback`.
+        Topics that are already being listened to only have their callback
+        replaced.
+        """
+        for topic in topics:
+            self._routes[topic] = callback
+
+        remaining = [topic for topic in topics if topic not in self._owners]
+        pending = []
+
+        while remaining:
+            connection = self._acquire()
+            free = self.max_topics - connection.topic_count
+
+            chunk, remaining = remaining[:free], remaining[free:]
+
+            connection.reserve(chunk, authorization_token)
+            pending.append(connection.listen_topics(chunk, authorization_token))
+
+            for topic in chunk:
+                self._owners[topic] = connection
+
+        await asyncio.wait_for(asyncio.gather(*pending), self.listen_timeout)
+
+    async def unlisten(self, topics: List[str]) -> None:
+        """
+        Stop listening to the given topics. Only the connections holding them
+        are touched, and any left without topics are closed.
+        """
+        topics_by_connection: Dict[Pubsub, List[str]] = {}
+
+        for topic in topics:
+            self._routes.pop(topic, None)
+            connection = self._owners.pop(topic, None)
+
+            if connection is not None:
+                topics_by_connection.setdefault(connection, []).append(topic)
+
+        for connection, connection_topics in topics_by_connection.items():
+            try:
+                await connection.unlisten_topics(connection_topics)
+            except websockets.exceptions.WebSocketException as error:
+                log.debug(f"Failed to UNLISTEN, the topics are dropped anyway: {error!r}")
+
+            if connection.topic_count == 0:
+                await self._close_connection(connection)
+
+    async def _close_connection(self, connection: Pubsub) -> None:
+        self._connections.remove(connection)
+
+        task = self._tasks.pop(connection, None)
+
+        if task is not None:
+            task.cancel()
+
+        await connection.close()
+
+        log.debug(f"Closed an empty PubSub connection, {len(self._connections)} left")
+
+    async def _route(self, event: dict) -> None:
+        topic = event.get("data", {}).get("topic")
+        callback = self._routes.get(topic)
+
+        if callback is not None:
+            await callback(event)
+
+    async def close(self) -> None:
+        for task in list(self._tasks.values()):
+            task.cancel()
+
+        self._tasks.clear()
+
+        await asyncio.gather(
+            *[connection.close() for connection in self._connections],
+            return_exceptions=True
+        )
+
+        self._connections.clear()
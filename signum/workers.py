@@ -0,0 +1,307 @@
+"""
+
+Runs accounts across several processes, each with its own event loop, so that
+decoding, encoding and logging are spread over more than one core. The parent
+resolves the channels once and sends their state to every worker, and the
+workers send their log records back to the parent to be written out.
+
+"""
+
+import asyncio
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import signal
+from typing import List, Optional
+
+from .account import Account
+from .cache import config_cache
+from .logs import install_sampler
+from .channel import Channel
+from .credentials import Credentials
+from .manager import Manager
+from .poller import StatusPoller
+
+log = logging.getLogger(__name__)
+
+
+def shard(items: List, count: int) -> List[List]:
+    """ Split the items into `count` lists of near enough equal size. """
+    return [items[index::count] for index in range(count)]
+
+
+async def resolve_channels(account: Account, channel_names: List[str], batch_size: int = 25) -> List[tuple]:
+    """
+    Find every channel that exists, packed to be sent to the workers. The
+    channels are looked up `batch_size` at a time, each batch in one query.
+    """
+    chunks = [
+        channel_names[index:index + batch_size]
+        for index in range(0, len(channel_names), max(1, batch_size))
+    ]
+
+    results = await asyncio.gather(*[
+        account.fetch_channels(chunk) for chunk in chunks
+    ], return_exceptions=True)
+
+    channels = []
+
+    for chunk, result in zip(chunks, results):
+        if isinstance(result, Exception):
+            log.error(f"Failed to look up {len(chunk)} channel(s): {result!r}")
+            continue
+
+        for channel_name in chunk:
+            if not result.get(channel_name):
+                log.warning(f"Channel {channel_name} was not found on Twitch")
+            else:
+                channels.append(Channel(result[channel_name]).pack())
+
+    return channels
+
+
+def _worker_options(manager_options: dict, index: int, workers: int) -> dict:
+    """
+    Give each worker its own metrics port and files, and an even share of
+    the request budget and requests in flight for each host. Workers don't
+    poll the channels themselves.
+    """
+    options = dict(manager_options)
+
+    for name in ("host_rate", "max_concurrency"):
+        if options.get(name) is not None:
+            options[name] /= max(1, workers)
+
+    # The parent polls the channels for every worker.
+    options["poll_interval"] = 0
+
+    if options.get("snapshot_file") is not None:
+        options["snapshot_file"] = f"{options['snapshot_file']}.{index}"
+
+    if options.get("record_file") is not None:
+        # Keep `.gz` at the end so the recording is still compressed.
+        base, extension = options["record_file"], ""
+
+        if base.endswith(".gz"):
+            base, extension = base[:-3], ".gz"
+
+        options["record_file"] = f"{base}.{index}{extension}"
+
+    if options.get("metrics_port") is not None:
+        options["metrics_port"] += index
+
+    if options.get("metrics_file") is not None:
+        options["metrics_file"] = f"{options['metrics_file']}.{index}"
+
+    return options
+
+
+def _get(channel_queue: multiprocessing.Queue, timeout: float) -> Optional[List[dict]]:
+    try:
+        return channel_queue.get(timeout=timeout)
+    except queue.Empty:
+        return None
+
+
+async def _receive_channels(manager: Manager, channel_queue: multiprocessing.Queue, worker: asyncio.Task) -> None:
+    """
+    Apply channel state sent by the parent process, stopping the worker if
+    the parent has gone without terminating it.
+    """
+    loop = asyncio.get_running_loop()
+    parent = multiprocessing.parent_process()
+
+    while True:
+        channels = await loop.run_in_executor(None, _get, channel_queue, 1.0)
+
+        for packed in channels or []:
+            manager.apply_channel(Channel.unpack(packed))
+
+        if parent is not None and not parent.is_alive():
+            log.warning("The parent process has exited, stopping the worker")
+            worker.cancel()
+            return
+
+
+async def _run_worker(
+    credentials: List[Credentials],
+    manager_options: dict,
+    account_options: dict,
+    channel_queue: multiprocessing.Queue
+) -> None:
+    loop = asyncio.get_running_loop()
+    worker = asyncio.current_task()
+    loop.add_signal_handler(signal.SIGTERM, worker.cancel)
+
+    manager = Manager([], **manager_options)
+
+    for account_credentials in credentials:
+        manager.add_account(Account(credentials=account_credentials, **account_options))
+
+    # The first message always holds every channel.
+    for packed in await loop.run_in_executor(None, channel_queue.get):
+        manager.apply_channel(Channel.unpack(packed))
+
+    receiver = loop.create_task(_receive_channels(manager, channel_queue, worker))
+
+    try:
+        await manager.run()
+    finally:
+        receiver.cancel()
+
+
+class _LogQueueHandler(logging.handlers.QueueHandler):
+    """ Sends log records to the parent, without what can't be pickled. """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+
+        # The websockets library attaches the connection to its records.
+        record.__dict__.pop("websocket", None)
+
+        return record
+
+
+def _worker_main(
+    index: int,
+    credentials: List[Credentials],
+    manager_options: dict,
+    account_options: dict,
+    cache_options: dict,
+    channel_queue: multiprocessing.Queue,
+    log_queue: multiprocessing.Queue,
+    log_sample: int
+) -> None:
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(_LogQueueHandler(log_queue))
+    root.setLevel(logging.DEBUG)
+
+    # Sampling here means fewer records are pickled over to the parent.
+    install_sampler(log_sample)
+
+    config_cache.configure(**cache_options)
+
+    log.debug(f"Worker {index} started with {len(credentials)} account(s)")
+
+    try:
+        asyncio.run(_run_worker(credentials, manager_options, account_options, channel_queue))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+async def run_workers(
+    credentials: List[Credentials],
+    channel_names: List[str],
+    workers: int,
+    manager_options: dict,
+    account_options: dict,
+    cache_options: dict,
+    log_sample: int = 1
+) -> None:
+    """
+    Shard the accounts over `workers` processes and keep them supplied with
+    channel state until they all exit. The channels are polled here, once
+    for every worker, and only channels that changed are sent on.
+    """
+    if len(credentials) < 1:
+        raise Exception("No valid accounts were found")
+
+    context = multiprocessing.get_context("spawn")
+
+    poll_interval = manager_options.get("poll_interval", 60.0)
+    batch_size = manager_options.get("poll_batch_size", 25)
+
+    resolver = Account(credentials=credentials[0], **account_options)
+
+    log_queue = context.Queue()
+    listener = logging.handlers.QueueListener(
+        log_queue,
+        *logging.getLogger().handlers,
+        respect_handler_level=True
+    )
+
+    processes: List[multiprocessing.Process] = []
+    channel_queues: List[multiprocessing.Queue] = []
+    poller_task: Optional[asyncio.Task] = None
+
+    # Stop the workers on the way out, rather than leaving them orphaned.
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    listener.start()
+
+    try:
+        await resolver.initialize_user()
+        channels = await resolve_channels(resolver, channel_names, batch_size)
+
+        if len(channels) < 1:
+            raise Exception("No valid channels were found")
+
+        # Credentials are sent already parsed, so workers never read the files.
+        for index, shard_credentials in enumerate(shard(credentials, workers)):
+            if not shard_credentials:
+                continue
+
+            channel_queue = context.Queue()
+            channel_queue.put(channels)
+
+            process = context.Process(
+                target=_worker_main,
+                args=(index, shard_credentials, _worker_options(manager_options, index, workers), account_options, cache_options, channel_queue, log_queue, log_sample),
+                name=f"signum-worker-{index}"
+            )
+            process.start()
+
+            processes.append(process)
+            channel_queues.append(channel_queue)
+
+        log.info(f"Started {len(processes)} worker(s) for {len(credentials)} account(s)")
+
+        # Last state sent to the workers, by channel ID.
+        sent = {packed[0]: packed for packed in channels}
+
+        async def poll() -> int:
+            changed = [
+                packed for packed in await resolve_channels(resolver, channel_names, batch_size)
+                if sent.get(packed[0]) != packed
+            ]
+
+            corrected = sum(
+                1 for packed in changed
+                if packed[0] in sent and Channel.unpack(packed).is_streaming != Channel.unpack(sent[packed[0]]).is_streaming
+            )
+
+            sent.update({packed[0]: packed for packed in changed})
+
+            if changed:
+                for channel_queue in channel_queues:
+                    channel_queue.put(changed)
+
+            return corrected
+
+        if poll_interval > 0:
+            poller = StatusPoller(poll_interval, manager_options.get("max_poll_interval", 600.0))
+            poller_task = asyncio.get_running_loop().create_task(poller.run(poll))
+
+        while any(process.is_alive() for process in processes):
+            await asyncio.sleep(1)
+
+        log.warning("Every worker has exited")
+
+    finally:
+        if poller_task is not None:
+            poller_task.cancel()
+
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+        for process in processes:
+            process.join(10)
+
+            if process.is_alive():
+                process.kill()
+
+        listener.stop()
+
+        await resolver.close()
@@ -0,0 +1,49 @@
+import unittest
+
+from signum.planner import ChannelPlanner
+
+
+class ChannelPlannerTest(unittest.TestCase):
+    def setUp(self):
+        self.planner = ChannelPlanner(max_channels=2)
+
+        for channel_id in (1, 2, 3):
+            self.planner.add_channel(channel_id, live=True)
+
+        self.planner.add_account(100)
+
+    def test_plans_at_most_max_channels(self):
+        self.assertEqual(self.planner.channels_for(100), [1, 2])
+
+    def test_higher_priority_goes_first(self):
+        self.planner.add_channel(4, priority=1, live=True)
+
+        self.assertIn(4, self.planner.channels_for(100))
+
+    def test_balance_change_plans_the_account_again(self):
+        self.planner.update_balance(100, 1, 5000)
+
+        self.assertEqual(self.planner.channels_for(100), [2, 3])
+
+    def test_streak_is_kept_over_a_lower_balance(self):
+        self.planner.mark_streak(100, 3)
+        self.planner.update_balance(100, 3, 5000)
+
+        self.assertIn(3, self.planner.channels_for(100))
+
+    def test_offline_channel_is_replaced(self):
+        self.planner.set_live(1, False)
+
+        self.assertEqual(self.planner.channels_for(100), [2, 3])
+
+    def test_streaks_end_with_the_stream(self):
+        self.planner.mark_streak(100, 3)
+        self.planner.set_live(3, False)
+        self.planner.set_live(3, True)
+        self.planner.update_balance(100, 3, 5000)
+
+        self.assertNotIn(3, self.planner.channels_for(100))
+
+
+if __name__ == "__main__":
+    unittest.main()
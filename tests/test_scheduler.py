@@ -0,0 +1,63 @@
+import asyncio
+import unittest
+
+from signum.scheduler import WatchScheduler
+
+
+class WatchSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def run_ticks(self, scheduler: WatchScheduler, job_time: float, ticks: int) -> int:
+        """ Run one job a tick for `ticks` ticks, returning how many ran. """
+        runs = 0
+
+        async def job():
+            nonlocal runs
+            runs += 1
+
+            await asyncio.sleep(job_time)
+
+        task = asyncio.get_running_loop().create_task(scheduler.run(lambda: [("account", job)]))
+
+        await asyncio.sleep(scheduler.period * (ticks + 1))
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        return runs
+
+    async def test_job_running_past_the_tick_is_not_skipped(self):
+        scheduler = WatchScheduler(period=0.2)
+        scheduler.offset = lambda key: 0.9 * scheduler.period
+
+        # Each job is still running at the next tick, but done long before
+        # the next job is due.
+        runs = await self.run_ticks(scheduler, 0.15 * scheduler.period, 10)
+
+        self.assertEqual(runs, 10)
+        self.assertEqual(scheduler.skipped_jobs, 0)
+
+    async def test_job_running_past_the_next_start_is_skipped(self):
+        scheduler = WatchScheduler(period=0.2)
+        scheduler.offset = lambda key: 0.5 * scheduler.period
+
+        runs = await self.run_ticks(scheduler, 1.5 * scheduler.period, 10)
+
+        self.assertEqual(runs, 5)
+        self.assertEqual(scheduler.skipped_jobs, 5)
+
+    async def test_cancel_stops_waiting_and_running_jobs(self):
+        scheduler = WatchScheduler(period=0.2)
+        scheduler.offset = lambda key: 0.9 * scheduler.period
+
+        task = asyncio.get_running_loop().create_task(scheduler.run(lambda: [("account", lambda: asyncio.sleep(1))]))
+
+        await asyncio.sleep(2.5 * scheduler.period)
+        await scheduler.cancel("account")
+
+        self.assertNotIn("account", scheduler._running)
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    unittest.main()